@@ -0,0 +1,205 @@
+"""helper functions for the read-only json api on the sqlite store of the counts
+
+A request reads one range of the index of the store and never loads the dataset.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+from urllib.parse import urlencode
+
+from flask import Response, request
+
+from cache_helper import files_version
+from map_helper import negotiate_encoding
+from store_helper import STORE_PATH
+
+API_ROUTE = "/api"
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Bins of the counts labelled by their last day like the resampled bar chart, hours from the hourly counts
+FREQUENCIES = {
+    "H": "timestamp",
+    "D": "day",
+    "W": "date(day, 'weekday 0')",
+    "M": "date(day, 'start of month', '+1 month', '-1 day')",
+    "Y": "strftime('%Y-12-31', day)",
+}
+
+
+class ApiError(ValueError):
+    """invalid request, answered with the http status and message as json"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_date(value, name):
+    """returns iso date of a query parameter"""
+    try:
+        return datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ApiError(f"{name} must be a date like 2019-01-31") from None
+
+
+def parse_limit(args):
+    """returns page size of a request"""
+    try:
+        limit = int(args.get("limit", PAGE_SIZE))
+    except ValueError:
+        raise ApiError("limit must be an integer") from None
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ApiError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+
+def next_url(args, after):
+    """returns url of the page after the given key"""
+    return f"{request.path}?{urlencode({**args.to_dict(), 'after': after})}"
+
+
+class CountStore:
+    """read-only connections to the sqlite store, one per thread
+
+    Connections are reopened when data_wrangling.py has replaced the file.
+    """
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self.local = threading.local()
+
+    def version(self):
+        """returns string changing whenever the store is rewritten, empty if there is none"""
+        return files_version(self.path)
+
+    def connection(self):
+        """returns connection of this thread to the current store"""
+        version = self.version()
+        if not version:
+            raise ApiError("the store has not been built, run data_wrangling.py", status=503)
+        if getattr(self.local, "version", None) != (os.getpid(), version):
+            if getattr(self.local, "connection", None) is not None:
+                self.local.connection.close()
+            uri = f"{pathlib.Path(self.path).absolute().as_uri()}?mode=ro"
+            self.local.connection = sqlite3.connect(uri, uri=True)
+            self.local.version = (os.getpid(), version)
+        return self.local.connection
+
+    def stations(self, args):
+        """returns page of stations with their first and last day of counts"""
+        limit = parse_limit(args)
+        try:
+            after = int(args.get("after", -1))
+        except ValueError:
+            raise ApiError("after must be a station code") from None
+        rows = self.connection().execute(
+            """
+            SELECT station_code, station, description, station_short, lat, lon,
+                (SELECT MIN(day) FROM daily WHERE daily.station_code = stations.station_code),
+                (SELECT MAX(day) FROM daily WHERE daily.station_code = stations.station_code)
+            FROM stations
+            WHERE station_code > ?
+            ORDER BY station_code
+            LIMIT ?
+            """,
+            (after, limit + 1),
+        ).fetchall()
+        columns = ["station_code", "station", "description", "station_short", "lat", "lon", "first_day", "last_day"]
+        data = [dict(zip(columns, row)) for row in rows[:limit]]
+        return {
+            "data": data,
+            "next": next_url(args, data[-1]["station_code"]) if len(rows) > limit else None,
+        }
+
+    def counts(self, args):
+        """returns page of the counts of a station summed up per hour, day, week, month or year
+
+        Bins are labelled by their last day and only sum up the days between from and to,
+        bins without counts are left out.
+        """
+        if "station" not in args:
+            raise ApiError("station is required")
+        frequency = args.get("freq", "D")
+        if frequency not in FREQUENCIES:
+            raise ApiError(f"freq must be one of {', '.join(FREQUENCIES)}")
+        first = parse_date(args["from"], "from") if "from" in args else "0000-01-01"
+        last = parse_date(args["to"], "to") if "to" in args else "9999-12-30"
+        after = args.get("after", "")
+        if after:
+            try:
+                datetime.datetime.fromisoformat(after)
+            except ValueError:
+                raise ApiError("after must be the timestamp of the last row of a page") from None
+        limit = parse_limit(args)
+        connection = self.connection()
+        code = connection.execute(
+            "SELECT station_code FROM stations WHERE station = ?", (args["station"],)
+        ).fetchone()
+        if code is None:
+            raise ApiError(f"unknown station {args['station']}", status=404)
+        if frequency == "H":
+            # to is inclusive, hours are compared as text up to the next day
+            end = (datetime.date.fromisoformat(last) + datetime.timedelta(days=1)).isoformat()
+            sql = """
+                SELECT timestamp, total_bikes FROM counts
+                WHERE station_code = ? AND timestamp >= ? AND timestamp < ? AND timestamp > ?
+                ORDER BY timestamp LIMIT ?
+            """
+            parameters = (code[0], first, end, after, limit + 1)
+        else:
+            # Bins end on their label, so the days after the label of the last page start the next one
+            sql = f"""
+                SELECT {FREQUENCIES[frequency]} AS bin, SUM(total_bikes) FROM daily
+                WHERE station_code = ? AND day >= ? AND day <= ? AND day > ?
+                GROUP BY bin ORDER BY bin LIMIT ?
+            """
+            parameters = (code[0], first, last, after, limit + 1)
+        rows = connection.execute(sql, parameters).fetchall()
+        data = [{"timestamp": timestamp, "total_bikes": total} for timestamp, total in rows[:limit]]
+        return {
+            "station": args["station"],
+            "freq": frequency,
+            "data": data,
+            "next": next_url(args, data[-1]["timestamp"]) if len(rows) > limit else None,
+        }
+
+
+def request_etag(version, args):
+    """returns strong etag of a request on a version of the store"""
+    key = json.dumps([version, request.path, sorted(args.items(multi=True))])
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def register_api(server, store, route=API_ROUTE):
+    """serves the stations and counts of the store as json with compression and etags
+
+    Etags derive from the store version and the query, so unchanged results
+    are answered with 304 without running the query.
+    """
+
+    def serve(query):
+        encoding, etag = negotiate_encoding(["gzip"], request_etag(store.version(), request.args))
+        headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        try:
+            payload, status = query(request.args), 200
+        except ApiError as error:
+            payload, status = {"error": str(error)}, error.status
+            del headers["ETag"]
+            headers["Cache-Control"] = "no-store"
+        content = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode()
+        if encoding != "identity":
+            content = gzip.compress(content, compresslevel=6, mtime=0)
+            headers["Content-Encoding"] = encoding
+        return Response(content, status=status, mimetype="application/json", headers=headers)
+
+    server.add_url_rule(f"{route}/stations", "api_stations", lambda: serve(store.stations))
+    server.add_url_rule(f"{route}/counts", "api_counts", lambda: serve(store.counts))
@@ -1,21 +1,80 @@
 """bike count dashboard in dash"""
 
+import os
+
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
 import pandas as pd
 import plotly.graph_objects as go
-import plotly.express as px
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
 
+from api_helper import CountStore, register_api
 from barchart_helper import (
+    DAYS_PER_BIN,
+    MAX_BARS,
     Frequency,
-    get_parts_for_barchart,
+    bin_frequency,
+    get_daily_totals_for_barchart_from_engine,
+    get_parts_for_barchart_from_engine,
     frequency_dict,
     streets_dict,
+    visible_range,
+    window_for_barchart,
+)
+from cache_helper import files_version, make_cache, memoize, normalize_years
+from comparison_helper import (
+    AGGREGATIONS,
+    ComparisonBetweenStations,
+    aggregate_from_engine,
+    map_colors,
+)
+from cube_helper import CUBE_PATH, load_cube
+from dataset_helper import (
+    CSV_PATH,
+    DATASET_PATH,
+    load_compact_dataset,
+    without_object_columns,
 )
-from comparison_helper import ComparisonBetweenStations, aggregate, map_colors
-from polar_helper import prepare_data_for_polar
+from map_helper import StationMap, map_url, register_map_route
+from matrix_helper import MATRIX_PATH, load_count_matrix
+from metrics_helper import instrument, register_metrics, timed
+from partition_helper import PartitionIndex
+from station_helper import STATIONS_PATH, load_station_registry
+from polar_helper import prepare_data_for_polar_from_engine
+from query_helper import make_engine
+
+# Resample the bar chart in the browser from daily totals sent once per street,
+# set BIKE_CLIENTSIDE_BARCHART=0 to resample on the server for every frequency change
+CLIENTSIDE_BARCHART = os.environ.get("BIKE_CLIENTSIDE_BARCHART", "1") != "0"
+BARCHART_COLORS = ["dodgerblue", "purple"]
+BARCHART_XAXIS = dict(
+    rangeselector=dict(
+        buttons=list(
+            [
+                dict(count=1, label="1m", step="month", stepmode="backward"),
+                dict(count=6, label="6m", step="month", stepmode="backward"),
+                dict(count=1, label="YTD", step="year", stepmode="todate"),
+                dict(count=1, label="1y", step="year", stepmode="backward"),
+                dict(step="all"),
+            ]
+        )
+    ),
+    rangeslider=dict(visible=True),
+    type="date",
+)
+
+# Traces of the polar chart from the widest to the narrowest, so the filled areas stay visible
+POLAR_TRACES = {
+    "max": dict(label="max", hover="Max: %{r}", color="lightgreen", fill="toself"),
+    "p95": dict(label="95th percentile", hover="95th percentile: %{r}", color="mediumseagreen", fill="toself"),
+    "p75": dict(label="75th percentile", hover="75th percentile: %{r}", color="lightskyblue", fill="toself"),
+    "median": dict(label="median", hover="Median: %{r}", color="dodgerblue", fill="toself"),
+    "p25": dict(label="25th percentile", hover="25th percentile: %{r}", color="steelblue", fill="toself"),
+    "mean": dict(label="mean", hover="Mean: %{r:.1f}", color="darkorange", fill="none"),
+}
+# Traces shown without selecting them in the legend or as radial range
+POLAR_SHOWN = ["max", "median"]
 
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 
@@ -23,13 +82,57 @@ app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
 server = app.server
 
-# Read in the data and transform
-df = pd.read_csv('berlin_bikedata_2017-2019_reduced.csv', index_col='timestamp', parse_dates=True)
 
-# Create empty figures
-comparison_fig = go.Figure()
-barchart_fig = go.Figure()
-fig = go.Figure()
+def load_data():
+    """returns partition index of the hourly counts, count matrix and rollup cube used by the callbacks"""
+    # Hourly counts as memory-mapped station x hour matrix shared by all workers, if built
+    matrix = load_count_matrix()
+    # Precomputed aggregates, None if data_wrangling.py has not built the cube
+    cube = load_cube()
+    if matrix is None:
+        # Read in hourly counts with integer station codes
+        df = load_compact_dataset().counts
+    else:
+        # The long table is only needed for aggregates the cube would provide
+        df = matrix.to_counts() if cube is None else None
+    # Contiguous rows per station and year, so callbacks read slices instead of masking all rows
+    partitions = None if df is None else PartitionIndex(df)
+    return partitions, matrix, cube
+
+
+registry = load_station_registry()
+# Builds without registry only have the station table in the dataset
+stations = registry.stations if registry is not None else load_compact_dataset().stations
+# Only numeric arrays and arrow strings, so gunicorn workers forked from a preloading
+# master share the pages of the data instead of copying them (see gunicorn.conf.py)
+stations = without_object_columns(stations)
+
+# Queries of the callbacks, on the loaded data or with BIKE_QUERY_ENGINE=duckdb on the
+# parquet dataset. The layout only needs the small station registry, the data is loaded
+# in the background and callbacks wait for it. Set BIKE_LAZY_LOAD=0 to load it before serving.
+engine = make_engine(load_data, stations)
+if os.environ.get("BIKE_LAZY_LOAD", "1") == "0":
+    engine.load()
+
+# Map page with all stations, kept in memory and served compressed with cache headers
+station_map = StationMap.from_stations(stations)
+register_map_route(server, station_map)
+
+# Read-only json api on the sqlite store written by data_wrangling.py, see api_helper.py
+register_api(server, CountStore())
+
+# Bounded cache of callback results, shared by all workers if BIKE_CACHE_DIR is set,
+# falling back to the results of precompute.py
+data_version = files_version(MATRIX_PATH, CUBE_PATH, STATIONS_PATH, DATASET_PATH, CSV_PATH)
+result_cache = make_cache(version=data_version)
+
+# Callback and stage timings, rows processed and cache counters at /metrics
+register_metrics(server, result_cache)
+
+# Create empty figures, plain dicts do not load the plotly templates at startup
+comparison_fig = {"data": [], "layout": {}}
+barchart_fig = {"data": [], "layout": {}}
+fig = {"data": [], "layout": {}}
 
 # Dashboard layout
 app.layout = html.Div(
@@ -71,7 +174,7 @@ app.layout = html.Div(
                                     id="station-dropdown",
                                     options=[
                                         {"label": item, "value": item}
-                                        for item in df["description"].unique().tolist()
+                                        for item in stations["description"].tolist()
                                     ],
                                     clearable=False,
                                     multi=False,
@@ -95,14 +198,26 @@ app.layout = html.Div(
                                 dcc.Dropdown(
                                     id="radialrange-dropdown",
                                     options=[
-                                        {"label": "max", "value": "max"},
-                                        {"label": "median", "value": "median"},
+                                        {"label": values["label"], "value": statistic}
+                                        for statistic, values in POLAR_TRACES.items()
                                     ],
                                     clearable=False,
                                     multi=False,
                                     value="max",
                                     placeholder="radial range",
                                 ),
+                                html.H4("Comparison:", className="control_label"),
+                                dcc.Dropdown(
+                                    id="comparison-dropdown",
+                                    options=[
+                                        {"label": values["label"], "value": aggregation}
+                                        for aggregation, values in AGGREGATIONS.items()
+                                    ],
+                                    clearable=False,
+                                    multi=False,
+                                    value="sum",
+                                    placeholder="comparison",
+                                ),
                         ], className="pretty-container"),
 
                     ],
@@ -124,9 +239,7 @@ app.layout = html.Div(
                                 #
                                 html.Iframe(
                                     id="map",
-                                    srcDoc=open(
-                                        "folium_maps/Maybachufer.html", "r"
-                                    ).read(),
+                                    src=map_url(station_map, "Maybachufer"),
                                     width="100%",
                                     height="300",
                                 ),
@@ -171,6 +284,7 @@ app.layout = html.Div(
                                     id="bar-chart",
                                     figure=barchart_fig,
                                 ),
+                                dcc.Store(id="barchart-store"),
                             ],
                             className="pretty-container",
                         ),
@@ -224,7 +338,7 @@ app.layout = html.Div(
 
 
 @app.callback(
-    [Output("scatter-polar", "figure"), Output("map", "srcDoc"), Output("comparison-bar", "figure")],
+    Output("scatter-polar", "figure"),
     [
         Input("year-dropdown", "value"),
         Input("station-dropdown", "value"),
@@ -232,44 +346,48 @@ app.layout = html.Div(
         Input("radialrange-dropdown", "value"),
     ],
 )
+@instrument("update_fig")
+@memoize(
+    result_cache,
+    lambda year, station, timeframe, radialrange: (
+        normalize_years(year), station, timeframe, radialrange
+    ),
+)
 def update_fig(year, station, timeframe, radialrange):
     """updates polar chart"""
-    is_year = df["year"].isin(year)
-    complete_df = df[is_year]
     category_sorters = {"day_name": "weekday", "hour_str": "hour", "month_name": "month"}
-    df_median, df_max, radialrange_dict, categories = prepare_data_for_polar(
-        complete_df, timeframe, category_sorters, station
+    polar_parts = prepare_data_for_polar_from_engine(
+        engine, timeframe, category_sorters, station, stations, year
     )
+    with timed("polar_figure"):
+        return polar_figure(*polar_parts, station, radialrange)
 
-    fig = go.Figure()
 
-    fig.add_trace(
-        go.Scatterpolar(
-            r=df_max["total_bikes"],
-            theta=categories,
-            fill="toself",
-            name="max",
-            fillcolor="lightgreen",
-            mode="markers",
-            text=df_max["location"],
-            marker_color="lightgreen",
-            hovertemplate="<b>%{text}</b><br><i>%{theta}</i><br><br>Max: %{r} bikes<extra></extra>",
-        )
-    )
+def polar_figure(stats_df, radialrange_dict, categories, station, radialrange):
+    """returns scatter polar chart of the maximum, quantiles and mean of the bikes
+
+    Max and median are shown, the other statistics can be shown from the legend
+    and are shown when selected as radial range.
+    """
+    fig = go.Figure()
 
-    fig.add_trace(
-        go.Scatterpolar(
-            r=df_median["total_bikes"],
-            theta=categories,
-            fill="toself",
-            name="median",
-            fillcolor="dodgerblue",
-            mode="markers",
-            marker_color="dodgerblue",
-            text=df_median["location"],
-            hovertemplate="<b>%{text}</b><br><i>%{theta}</i><br><br>Median: %{r} bikes<extra></extra>",
+    for statistic, values in POLAR_TRACES.items():
+        fig.add_trace(
+            go.Scatterpolar(
+                r=stats_df[statistic],
+                theta=categories,
+                fill=values["fill"],
+                name=values["label"],
+                fillcolor=values["color"],
+                mode="markers" if values["fill"] == "toself" else "lines+markers",
+                marker_color=values["color"],
+                text=stats_df["location"],
+                hovertemplate=(
+                    f"<b>%{{text}}</b><br><i>%{{theta}}</i><br><br>{values['hover']} bikes<extra></extra>"
+                ),
+                visible=True if statistic in POLAR_SHOWN + [radialrange] else "legendonly",
+            )
         )
-    )
 
     fig.update_layout(
         showlegend=True,
@@ -287,14 +405,58 @@ def update_fig(year, station, timeframe, radialrange):
         ),
     )
 
-    # Prepare data for comparison bar chart
-    aggregation_type = "sum"
-    x_label = "Total Bikes"
-    if radialrange == "median":
-        aggregation_type = "mean"
-        x_label = "Average Bikes"
-    comparison = ComparisonBetweenStations(year, aggregation_type)
-    agg_comp_df = aggregate(df, comparison)
+    return fig
+
+
+# Selecting a station only changes the fragment of the map url, the map page
+# then centers and highlights the station without being reloaded
+app.clientside_callback(
+    """
+    function(station, src) {
+        return src.split("#")[0] + "#" + encodeURIComponent(station);
+    }
+    """,
+    Output("map", "src"),
+    [Input("station-dropdown", "value")],
+    [State("map", "src")],
+)
+
+
+@memoize(result_cache, lambda year, aggregation: (normalize_years(year), aggregation))
+def aggregate_comparison(year, aggregation):
+    """returns comparison parameters and aggregated bikes per station for the comparison chart"""
+    comparison = ComparisonBetweenStations(year, aggregation)
+    agg_comp_df = aggregate_from_engine(engine, comparison, stations)
+    return comparison, agg_comp_df
+
+
+@app.callback(
+    Output("comparison-bar", "figure"),
+    [
+        Input("year-dropdown", "value"),
+        Input("station-dropdown", "value"),
+        Input("comparison-dropdown", "value"),
+    ],
+)
+@instrument("update_comparison_fig")
+@memoize(
+    result_cache,
+    lambda year, station, aggregation: (normalize_years(year), station, aggregation),
+)
+def update_comparison_fig(year, station, aggregation):
+    """updates comparison bar chart, highlighting the selected station"""
+    # Aggregates are cached per years and aggregation, so highlighting another station only recolors
+    comparison, agg_comp_df = aggregate_comparison(year, aggregation)
+    with timed("comparison_figure"):
+        return comparison_figure(comparison, agg_comp_df, station)
+
+
+def comparison_figure(comparison, agg_comp_df, station):
+    """returns bar chart of the total or average bikes of all stations"""
+    # plotly.express is imported on first use, it is not needed to serve the layout
+    import plotly.express as px
+
+    x_label = AGGREGATIONS[comparison.aggregation]["axis"]
     stations_list, color_map = map_colors(agg_comp_df, station)
 
     # Bar chart with total or average bikes by year and bicycle counter
@@ -324,26 +486,51 @@ def update_fig(year, station, timeframe, radialrange):
     comparison_fig.update_layout(showlegend=False, title="All Stations (Total and Average)",
         title_x=0.5)
 
-    return fig, open(f"folium_maps/{station}.html", "r").read(), comparison_fig
+    return comparison_fig
 
 
-@app.callback(
-    Output("bar-chart", "figure"),
-    [
-        Input("two-direction-station-dropdown", "value"),
-        Input("frequency-dropdown", "value"),
-    ],
+@instrument("update_barchart_fig")
+@memoize(
+    result_cache,
+    lambda street, frequency, relayout_data: (street, frequency, visible_range(relayout_data)),
 )
-def update_barchart_fig(street, frequency):
-    """updates bar chart"""
+def update_barchart_fig(street, frequency, visible):
+    """updates bar chart, with coarser bins than selected if the visible range is too long"""
+    first_day, last_day = engine.extent()
+    # Bars of half a visible range on both sides are included, so panning does not show gaps
+    start, end = window_for_barchart(first_day, last_day, visible)
+    frequency = bin_frequency(frequency, (end - start).days + 1)
     barchart_object = Frequency(frequency, frequency_dict, street)
-    barchart_df, barchart_title = get_parts_for_barchart(df, barchart_object)
+    barchart_df, barchart_title = get_parts_for_barchart_from_engine(engine, barchart_object, stations)
+    # Bins are labelled by their last day
+    barchart_df = barchart_df[
+        (barchart_df.timestamp >= start)
+        & (barchart_df.timestamp < end + pd.Timedelta(days=DAYS_PER_BIN[frequency] + 1))
+    ]
+    with timed("barchart_figure"):
+        barchart_fig = barchart_figure(barchart_df, barchart_object, barchart_title, frequency)
+        # The range slider keeps showing all days, the zoom is kept across updates of a street
+        barchart_fig.update_layout(
+            xaxis_rangeslider_range=[
+                f"{first_day:%Y-%m-%d}", f"{last_day + pd.Timedelta(days=1):%Y-%m-%d}"
+            ],
+            uirevision=street,
+        )
+        if visible is not None:
+            barchart_fig.update_layout(xaxis_range=list(visible))
+        return barchart_fig
+
+
+def barchart_figure(barchart_df, barchart_object, barchart_title, frequency):
+    """returns bar chart of the counters of a street"""
+    import plotly.express as px
+
     barchart_fig = px.bar(
         barchart_df[barchart_df.station_short == barchart_object.location_id],
         x="timestamp",
         y="total_bikes",
         color="description",
-        color_discrete_sequence=["dodgerblue", "purple"],
+        color_discrete_sequence=BARCHART_COLORS,
         title=barchart_title,
         labels={
             "total_bikes": "Total Bikes",
@@ -352,26 +539,62 @@ def update_barchart_fig(street, frequency):
         },
     )
     barchart_fig.update_traces(hovertemplate=barchart_object.hovertext)
-    barchart_fig.update_layout(
-        xaxis=dict(
-            rangeselector=dict(
-                buttons=list(
-                    [
-                        dict(count=1, label="1m", step="month", stepmode="backward"),
-                        dict(count=6, label="6m", step="month", stepmode="backward"),
-                        dict(count=1, label="YTD", step="year", stepmode="todate"),
-                        dict(count=1, label="1y", step="year", stepmode="backward"),
-                        dict(step="all"),
-                    ]
-                )
-            ),
-            rangeslider=dict(visible=True),
-            type="date",
-        )
-    )
+    barchart_fig.update_layout(xaxis=BARCHART_XAXIS)
 
     return barchart_fig
 
 
+@instrument("update_barchart_store")
+@memoize(result_cache, lambda street: (street,))
+def update_barchart_store(street):
+    """returns daily totals of a street with the bar chart layout for resampling in the browser"""
+    totals, barchart_title = get_daily_totals_for_barchart_from_engine(engine, street, stations)
+    layout = go.Figure(
+        layout=dict(
+            title=dict(text=barchart_title),
+            barmode="relative",
+            legend=dict(title=dict(text="Street"), tracegroupgap=0),
+            xaxis=BARCHART_XAXIS,
+            yaxis=dict(title=dict(text="Total Bikes")),
+            uirevision=street,
+        )
+    ).to_dict()["layout"]
+    formats = {
+        frequency: values["d3_format"] for frequency, values in frequency_dict["frequency"].items()
+    }
+    return {
+        "totals": totals,
+        "layout": layout,
+        "colors": BARCHART_COLORS,
+        "formats": formats,
+        "maxBars": MAX_BARS,
+        "daysPerBin": DAYS_PER_BIN,
+    }
+
+
+if CLIENTSIDE_BARCHART:
+    app.callback(
+        Output("barchart-store", "data"), [Input("two-direction-station-dropdown", "value")]
+    )(update_barchart_store)
+    app.clientside_callback(
+        ClientsideFunction(namespace="barchart", function_name="resample"),
+        Output("bar-chart", "figure"),
+        [
+            Input("frequency-dropdown", "value"),
+            Input("bar-chart", "relayoutData"),
+            Input("barchart-store", "data"),
+        ],
+    )
+else:
+    app.callback(
+        Output("bar-chart", "figure"),
+        [
+            Input("two-direction-station-dropdown", "value"),
+            Input("frequency-dropdown", "value"),
+            Input("bar-chart", "relayoutData"),
+        ],
+    )(update_barchart_fig)
+
+
 if __name__ == "__main__":
     app.run_server(debug=False)
@@ -0,0 +1,103 @@
+// Resamples the daily totals sent by the barchart-store callback in the browser,
+// bins are labelled by their last day like pandas resample with D, W, M and Y.
+// Only bins around the visible range are drawn, with coarser bins than selected
+// if the range would have more than maxBars of them, like update_barchart_fig.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    barchart: {
+        resample: function (frequency, relayoutData, data) {
+            if (!data) {
+                return window.dash_clientside.no_update;
+            }
+            var day = 24 * 60 * 60 * 1000;
+            var binEnds = {
+                Day: function (y, m, d, weekday) { return Date.UTC(y, m, d); },
+                Week: function (y, m, d, weekday) { return Date.UTC(y, m, d + (7 - weekday) % 7); },
+                Month: function (y, m, d, weekday) { return Date.UTC(y, m + 1, 0); },
+                Year: function (y, m, d, weekday) { return Date.UTC(y, 11, 31); },
+            };
+            var frequencies = Object.keys(binEnds);
+
+            var first = Math.min.apply(null, data.totals.map(function (station) {
+                return Date.parse(station.start);
+            }));
+            var last = Math.max.apply(null, data.totals.map(function (station) {
+                return Date.parse(station.start) + (atob(station.counts).length / 4 - 1) * day;
+            }));
+            var visible = visibleRange(relayoutData);
+            var start = first;
+            var end = last;
+            if (visible) {
+                // half a visible range on both sides, so panning does not show gaps
+                var padding = Math.floor((visible[1] - visible[0]) / 2 / day) * day;
+                start = Math.max(visible[0] - padding, first);
+                end = Math.min(visible[1] + padding, last);
+            }
+            var nDays = (end - start) / day + 1;
+            frequencies.slice(frequencies.indexOf(frequency)).some(function (name) {
+                frequency = name;
+                return nDays / data.daysPerBin[name] <= data.maxBars;
+            });
+            var binEnd = binEnds[frequency];
+            var labelEnd = end + (data.daysPerBin[frequency] + 1) * day;
+
+            var traces = data.totals.map(function (station, i) {
+                var bytes = Uint8Array.from(atob(station.counts), function (c) { return c.charCodeAt(0); });
+                var counts = new Int32Array(bytes.buffer);
+                var stationStart = Date.parse(station.start);
+                var x = [];
+                var y = [];
+                var last = null;
+                for (var j = 0; j < counts.length; j++) {
+                    var date = new Date(stationStart + j * day);
+                    var binLabel = binEnd(date.getUTCFullYear(), date.getUTCMonth(), date.getUTCDate(), date.getUTCDay());
+                    if (binLabel < start || binLabel >= labelEnd) {
+                        continue;
+                    }
+                    if (binLabel === last) {
+                        y[y.length - 1] += counts[j];
+                    } else {
+                        x.push(new Date(binLabel).toISOString().slice(0, 10));
+                        y.push(counts[j]);
+                        last = binLabel;
+                    }
+                }
+                return {
+                    type: "bar",
+                    x: x,
+                    y: y,
+                    name: station.description,
+                    legendgroup: station.description,
+                    marker: {color: data.colors[i % data.colors.length]},
+                    hovertemplate: "<b>" + frequency + "</b>: %{x|" + data.formats[frequency] + "}<br><b>Total Bikes</b>: %{y}",
+                    showlegend: true,
+                };
+            });
+            var layout = JSON.parse(JSON.stringify(data.layout));
+            layout.xaxis.title = {text: frequency};
+            // the range slider keeps showing all days
+            layout.xaxis.rangeslider.range = [isoDay(first), isoDay(last + day)];
+            if (visible) {
+                layout.xaxis.range = [isoDay(visible[0]), isoDay(visible[1])];
+            }
+            return {data: traces, layout: layout};
+        },
+    },
+});
+
+function isoDay(time) {
+    return new Date(time).toISOString().slice(0, 10);
+}
+
+// returns first and last visible day of a relayoutData event, null if everything is shown
+function visibleRange(relayoutData) {
+    if (!relayoutData || relayoutData["xaxis.autorange"]) {
+        return null;
+    }
+    var bounds = relayoutData["xaxis.range"] || [relayoutData["xaxis.range[0]"], relayoutData["xaxis.range[1]"]];
+    if (bounds[0] === undefined || bounds[1] === undefined) {
+        return null;
+    }
+    return bounds.map(function (bound) {
+        return Date.parse(String(bound).slice(0, 10));
+    });
+}
@@ -1,7 +1,13 @@
 """helper functions for bar chart"""
 
+import base64
+
 import pandas as pd
 
+# bars per counter shown at most, coarser bins are used if the visible range has more
+MAX_BARS = 500
+DAYS_PER_BIN = {"Day": 1, "Week": 7, "Month": 365.25 / 12, "Year": 365.25}
+
 
 class Frequency:
     def __init__(self, frequency, frequency_dict, location_id):
@@ -12,21 +18,32 @@ class Frequency:
         self.hovertext = f"<b>{self.frequency}</b>: %{{x|{self.d3_format}}}<br><b>Total Bikes</b>: %{{y}}"
 
 
-def prepare_dataframe(df):
-    """updates dataframe for barchart"""
-    df["station_short"] = df.station.str.split("-", n=1, expand=True).rename(
-        columns={0: "station_short"}
-    )["station_short"]
-    df["timestamp"] = pd.to_datetime(df.timestamp)
-    return df
+def street_codes(stations, location_id):
+    """returns station codes of the counters of a street"""
+    return stations.index[stations.station_short == int(location_id)]
+
 
+def street_timeseries(df, codes, frequency_short, cube=None):
+    """returns total bikes of the given station codes resampled to frequency_short
 
-def get_parts_for_barchart(df, barchart_object):
-    """returns barchart_df, barchart_title"""
-    # .set_index("timestamp")
-    barchart_df = (
-        df.groupby(["description", "station_short"])[["total_bikes"]].resample(barchart_object.frequency_short).sum().reset_index()
+    Resamples the daily totals of the rollup cube instead of the hourly counts if one is given.
+    """
+    if cube is not None:
+        df = cube.daily
+    return (
+        df[df.station_code.isin(codes)]
+        .groupby("station_code")[["total_bikes"]]
+        .resample(frequency_short)
+        .sum()
+        .reset_index()
     )
+
+
+def barchart_parts(barchart_df, barchart_object, stations):
+    """returns resampled totals of a street with descriptions and barchart_title"""
+    barchart_df = barchart_df.join(
+        stations[["description", "station_short"]], on="station_code"
+    ).drop(columns="station_code")
     street_names = " / ".join(
         barchart_df[barchart_df.station_short == barchart_object.location_id][
             "description"
@@ -36,6 +53,83 @@ def get_parts_for_barchart(df, barchart_object):
     return barchart_df, barchart_title
 
 
+def get_parts_for_barchart(df, barchart_object, stations, cube=None):
+    """returns barchart_df, barchart_title
+
+    Only the counters of the street are resampled.
+    """
+    codes = street_codes(stations, barchart_object.location_id)
+    barchart_df = street_timeseries(df, codes, barchart_object.frequency_short, cube)
+    return barchart_parts(barchart_df, barchart_object, stations)
+
+
+def get_parts_for_barchart_from_engine(engine, barchart_object, stations):
+    """returns barchart_df, barchart_title queried with a query engine"""
+    codes = street_codes(stations, barchart_object.location_id)
+    barchart_df = engine.street_timeseries(codes, barchart_object.frequency_short)
+    return barchart_parts(barchart_df, barchart_object, stations)
+
+
+def daily_totals_parts(daily, stations):
+    """returns daily totals per station as dicts for the browser and barchart_title
+
+    Totals are dicts with the description, the first day and the daily totals of
+    consecutive days as base64 encoded little-endian int32 array, to be resampled
+    in the browser.
+    """
+    totals = []
+    for code, station_daily in daily.groupby("station_code"):
+        totals.append(
+            {
+                "description": stations.description[code],
+                "start": station_daily.timestamp.iloc[0].strftime("%Y-%m-%d"),
+                "counts": base64.b64encode(
+                    station_daily.total_bikes.to_numpy(dtype="<i4").tobytes()
+                ).decode(),
+            }
+        )
+    street_names = " / ".join(item["description"] for item in totals)
+    barchart_title = f"Data for Bicycle Counter {street_names}"
+    return totals, barchart_title
+
+
+def get_daily_totals_for_barchart_from_engine(engine, location_id, stations):
+    """returns daily totals of the counters of a street and barchart_title queried with a query engine"""
+    daily = engine.street_timeseries(street_codes(stations, location_id), "D")
+    return daily_totals_parts(daily, stations)
+
+
+def visible_range(relayout_data):
+    """returns first and last visible day of a relayoutData event, None if everything is shown"""
+    if not relayout_data or relayout_data.get("xaxis.autorange"):
+        return None
+    bounds = relayout_data.get("xaxis.range") or [
+        relayout_data.get("xaxis.range[0]"),
+        relayout_data.get("xaxis.range[1]"),
+    ]
+    if None in bounds:
+        return None
+    return tuple(pd.Timestamp(bound).strftime("%Y-%m-%d") for bound in bounds)
+
+
+def bin_frequency(frequency, n_days, max_bars=MAX_BARS):
+    """returns the selected frequency or the next coarser one with at most max_bars bins in n_days"""
+    frequencies = list(frequency_dict["frequency"])
+    for name in frequencies[frequencies.index(frequency) :]:
+        if n_days / DAYS_PER_BIN[name] <= max_bars:
+            return name
+    return frequencies[-1]
+
+
+def window_for_barchart(first_day, last_day, visible):
+    """returns visible range padded by half its length on both sides, within the data"""
+    if visible is None:
+        return first_day, last_day
+    start, end = pd.Timestamp(visible[0]), pd.Timestamp(visible[1])
+    padding = pd.Timedelta(days=(end - start).days // 2)
+    return max(start - padding, first_day), min(end + padding, last_day)
+
+
 frequency_dict = {
     "frequency": {
         "Day": {"short": "D", "d3_format": "%b %d, %Y (%a)"},
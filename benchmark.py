@@ -0,0 +1,427 @@
+"""benchmarks for the data wrangling steps, helpers and dashboard callbacks on synthetic data
+
+Run `python benchmark.py --output results.json` and compare the json files of two commits.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import data_wrangling
+from api_helper import MAX_PAGE_SIZE
+from barchart_helper import Frequency, frequency_dict, get_parts_for_barchart, street_codes
+from comparison_helper import AGGREGATIONS, ComparisonBetweenStations, aggregate
+from cube_helper import build_cube, load_cube, write_cube
+from dataset_helper import BackgroundLoad, load_compact_dataset, write_dataset
+from matrix_helper import load_count_matrix, write_count_matrix
+from partition_helper import PartitionIndex
+from polar_helper import prepare_data_for_polar, prepare_data_for_polar_from_engine
+from query_helper import DuckDBEngine, PandasEngine, duckdb
+from station_helper import STATION_ID_FIXES, StationRegistry, write_station_registry
+from store_helper import write_store
+
+# station ids and descriptions in the format of the source workbook
+STATIONS = [
+    ("02-MI-JAN-N", "Jannowitzbrücke Nord"),
+    ("02-MI-JAN-S", "Jannowitzbrücke Süd"),
+    ("03-MI-SAN-O", "Invalidenstraße Ost"),
+    ("03-MI-SAN-W", "Invalidenstraße West"),
+    ("05-FK-OBB-O", "Oberbaumbrücke Ost"),
+    ("05-FK-OBB-W", "Oberbaumbrücke West"),
+    ("06-FK-FRA-O", "Frankfurter Allee Ost"),
+    ("06-FK-FRA-W", "Frankfurter Allee West"),
+    ("10-PA-BER-N", "Berliner Straße Nord"),
+    ("10-PA-BER-S", "Berliner Straße Süd"),
+    ("12-PA-SCH", "Schwedter Steg"),
+    ("13-CW-PRI", "Prinzregentenstraße"),
+    ("15-SP-KLO-N", "Klosterstraße Nord"),
+    ("15-SP-KLO-S", "Klosterstraße Süd"),
+    ("17-SZ-BRE-O", "Breitenbachplatz Ost"),
+    ("17-SZ-BRE-W", "Breitenbachplatz West"),
+    ("18-TS-YOR-O", "Yorckstraße Ost"),
+    ("18-TS-YOR-W", "Yorkstraße West"),
+    ("19-TS-MON", "Monumentenstraße"),
+    ("20-TS-MAR-N", "Mariendorfer Damm Nord"),
+    ("20-TS-MAR-S", "Mariendorfer Damm Süd"),
+    ("21-NK-MAY", "Maybachufer"),
+    ("23-TK-KAI", "Kaisersteg"),
+    ("24-MH-ALB", "Alberichstraße"),
+    ("26-LI-PUP", "Paul-und-Paula-Uferweg"),
+    ("27-RE-MAR", "Markstraße"),
+]
+
+
+def make_station_ids(n_stations):
+    """returns station ids in the format of the source workbook"""
+    extra = [f"{number:02d}-XX-S{number:02d}" for number in range(30, 30 + n_stations)]
+    return ([station_id for station_id, _ in STATIONS] + extra)[:n_stations]
+
+
+def make_locations(station_ids):
+    """returns synthetic table in the format of the Standortdaten sheet"""
+    descriptions = dict(STATIONS)
+    fixed_ids = [STATION_ID_FIXES.get(item, item) for item in station_ids]
+    return pd.DataFrame(
+        {
+            "Zählstelle": fixed_ids,
+            "Beschreibung - Fahrtrichtung": [
+                descriptions.get(item, f"Station {fixed}")
+                for item, fixed in zip(station_ids, fixed_ids)
+            ],
+            "Breitengrad": np.linspace(52.4, 52.6, len(fixed_ids)),
+            "Längengrad": np.linspace(13.2, 13.6, len(fixed_ids)),
+            "Installationsdatum": pd.Timestamp("2015-01-01"),
+        }
+    )
+
+
+def make_year_sheet(year, station_ids, noise=0.3, missing_share=0.01, seed=0):
+    """returns synthetic table in the format of a Jahresdatei sheet
+
+    Counts follow a daily cycle scaled by log-normal noise, a share of hours is missing.
+    """
+    rng = np.random.default_rng(seed + year)
+    timestamps = pd.date_range(f"{year}-01-01", f"{year}-12-31 23:00", freq="h")
+    daily_cycle = 1 + np.sin((timestamps.hour.to_numpy() - 6) / 24 * 2 * np.pi)
+    sheet = {"Zählstelle        Inbetriebnahme": timestamps}
+    for station_id in station_ids:
+        expected = 120 * daily_cycle * rng.lognormal(0, noise, len(timestamps))
+        counts = rng.poisson(expected).astype(float)
+        counts[rng.random(len(timestamps)) < missing_share] = np.nan
+        sheet[f"{station_id} 01.01.2015"] = counts
+    return pd.DataFrame(sheet)
+
+
+def legacy_create_yearly_table(df, locations):
+    """reference implementation of create_yearly_table using stack and merge"""
+    df = df.rename(columns={"Zählstelle        Inbetriebnahme": "timestamp"})
+    df.timestamp = pd.to_datetime(df.timestamp)
+    stacked = df.stack().reset_index()
+    merged = pd.merge(
+        stacked, df.timestamp.reset_index(), "left", left_on="level_0", right_on="index"
+    ).drop(columns=["level_0", "index"])
+    temp_df = (
+        merged[merged.level_1 != "timestamp"]
+        .set_index("timestamp")
+        .rename(columns={"level_1": "station", 0: "total_bikes"})
+    )
+    temp_df["total_bikes"] = temp_df["total_bikes"].astype(int)
+    temp_df["station"] = temp_df.station.str[:-11].str.strip()
+    temp_df["station"] = temp_df.station.replace(STATION_ID_FIXES)
+    temp_df["hour"] = temp_df.index.hour
+    temp_df["hour_str"] = temp_df.hour.astype(str) + " Uhr"
+    temp_df["weekday"] = temp_df.index.weekday
+    temp_df["day_name"] = temp_df.index.day_name()
+    temp_df["month"] = temp_df.index.month
+    temp_df["month_name"] = temp_df.index.month_name()
+    temp_df["year"] = temp_df.index.year
+    return (
+        pd.merge(
+            temp_df.reset_index(),
+            locations.drop(columns="Installationsdatum"),
+            "left",
+            left_on="station",
+            right_on="Zählstelle",
+        )
+        .drop(columns=["Zählstelle"])
+        .rename(
+            columns={
+                "Beschreibung - Fahrtrichtung": "description",
+                "Breitengrad": "lat",
+                "Längengrad": "lon",
+            }
+        )
+        .set_index("timestamp")
+    )
+
+
+# run in a fresh interpreter, prints seconds since start at which each stage of a cold start is done
+COLD_START = """
+import json, time
+start = time.perf_counter()
+import dash, pandas, plotly.graph_objects
+imported = time.perf_counter()
+import app
+layout_ready = time.perf_counter()
+client = app.server.test_client()
+client.get("/")
+client.get("/_dash-layout")
+first_paint = time.perf_counter()
+app.engine.load()
+data_ready = time.perf_counter()
+print(json.dumps({
+    "imports": imported - start,
+    "layout": layout_ready - start,
+    "first paint": first_paint - start,
+    "data loaded": data_ready - start,
+}))
+"""
+
+
+def measure(name, function, *args, repeat=3):
+    """returns fastest wall time of several runs and peak traced memory of one run"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = {"name": name, "seconds": min(timings), "peak_mb": peak / 2**20}
+    print(f"{name:<48} {result['seconds']:8.4f} s {result['peak_mb']:9.1f} MB")
+    return result
+
+
+def measure_callback(name, app, callback, *args, repeat=3):
+    """returns results of a cached callback computing every call (cold) and served from the cache (warm)"""
+
+    def cold(*args):
+        app.result_cache.clear()
+        return callback(*args)
+
+    results = [measure(f"{name} cold", cold, *args, repeat=repeat)]
+    callback(*args)
+    results.append(measure(f"{name} warm", callback, *args, repeat=repeat))
+    return results
+
+
+def measure_cold_start(repository, repeat=3):
+    """returns fastest time of each cold start stage of app.py in the working directory"""
+    env = dict(os.environ, PYTHONPATH=repository)
+    runs = [
+        json.loads(
+            subprocess.run(
+                [sys.executable, "-W", "ignore", "-c", COLD_START],
+                capture_output=True, text=True, check=True, env=env,
+            ).stdout
+        )
+        for _ in range(repeat)
+    ]
+    results = []
+    for stage in runs[0]:
+        result = {"name": f"app cold start[{stage}]", "seconds": min(run[stage] for run in runs)}
+        print(f"{result['name']:<48} {result['seconds']:8.4f} s")
+        results.append(result)
+    return results
+
+
+def git_commit():
+    """returns current commit hash, None outside of a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_synthetic_build(table, registry):
+    """writes dataset, cube, station registry and count matrix like data_wrangling.py does"""
+    write_dataset(table)
+    write_cube(build_cube(table))
+    write_station_registry(registry)
+    write_count_matrix(registry.stations)
+    write_store(registry.stations)
+
+
+def run_benchmarks(args):
+    """returns list of benchmark results"""
+    station_ids = make_station_ids(args.stations)
+    locations = make_locations(station_ids)
+    registry = StationRegistry.from_locations(locations)
+    years = list(range(args.first_year, args.last_year + 1))
+    sheets = [make_year_sheet(year, station_ids, noise=args.noise) for year in years]
+
+    results = [
+        measure(
+            "legacy_create_yearly_table", legacy_create_yearly_table, sheets[-1], locations,
+            repeat=args.repeat,
+        ),
+        measure(
+            "data_wrangling.create_yearly_table",
+            data_wrangling.create_yearly_table, sheets[-1], registry, repeat=args.repeat,
+        ),
+        measure(
+            "data_wrangling.transform_concat_dataframes",
+            data_wrangling.transform_concat_dataframes, sheets, registry, repeat=args.repeat,
+        ),
+    ]
+    table = data_wrangling.transform_concat_dataframes(sheets, registry)
+    del sheets
+
+    repository = os.path.dirname(os.path.abspath(__file__))
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bike_benchmark_") as directory:
+        os.chdir(directory)
+        try:
+            write_synthetic_build(table, registry)
+            results += benchmark_build(args, years, directory, repository)
+        finally:
+            os.chdir(working_directory)
+    return results
+
+
+def benchmark_build(args, years, directory, repository):
+    """returns results of the helpers and callbacks on the build in the working directory"""
+    results = []
+    last_year = years[-1]
+    data = load_compact_dataset()
+    cube = load_cube()
+    df, stations = data.counts, data.stations
+    station = stations.description.iloc[0]
+    street = f"{stations.station_short.iloc[0]:02d}"
+    category_sorters = {"day_name": "weekday", "hour_str": "hour", "month_name": "month"}
+
+    for aggregation in AGGREGATIONS:
+        comparison = ComparisonBetweenStations([last_year], aggregation)
+        results.append(
+            measure(
+                f"comparison_helper.aggregate[{aggregation}]",
+                aggregate, df, comparison, stations, repeat=args.repeat,
+            )
+        )
+        results.append(
+            measure(
+                f"comparison_helper.aggregate[{aggregation}, cube]",
+                aggregate, df, comparison, stations, cube, repeat=args.repeat,
+            )
+        )
+    results.append(
+        measure(
+            "polar_helper.prepare_data_for_polar",
+            lambda: prepare_data_for_polar(
+                df[df["year"].isin([last_year])], "hour_str", category_sorters, station, stations
+            ),
+            repeat=args.repeat,
+        )
+    )
+    results.append(measure("partition_helper.PartitionIndex", PartitionIndex, df, repeat=args.repeat))
+    partitions = PartitionIndex(df)
+    for frequency in frequency_dict["frequency"]:
+        barchart_object = Frequency(frequency, frequency_dict, street)
+        results.append(
+            measure(
+                f"barchart_helper.get_parts_for_barchart[{frequency}]",
+                get_parts_for_barchart, df, barchart_object, stations, repeat=args.repeat,
+            )
+        )
+
+    results.append(
+        measure("store_helper.write_store", write_store, stations, repeat=args.repeat)
+    )
+
+    # Query engines on the hourly counts, on the cube and count matrix and on the parquet dataset
+    engines = {
+        "partitions": PandasEngine(BackgroundLoad(lambda: (partitions, None, None))),
+        "cube": PandasEngine(BackgroundLoad(lambda: (None, load_count_matrix(), cube))),
+    }
+    if duckdb is not None:
+        engines["duckdb"] = DuckDBEngine(stations)
+    codes = street_codes(stations, street)
+    for name, engine in engines.items():
+        results.append(
+            measure(
+                f"query_helper[{name}].station_profile",
+                engine.station_profile, codes[0], years, "hour", repeat=args.repeat,
+            )
+        )
+        results.append(
+            measure(
+                f"polar_helper.prepare_data_for_polar_from_engine[{name}]",
+                prepare_data_for_polar_from_engine,
+                engine, "hour_str", category_sorters, station, stations, [last_year],
+                repeat=args.repeat,
+            )
+        )
+        results.append(
+            measure(
+                f"query_helper[{name}].station_totals",
+                engine.station_totals, years, "p95", repeat=args.repeat,
+            )
+        )
+        results.append(
+            measure(
+                f"query_helper[{name}].street_timeseries",
+                engine.street_timeseries, codes, "D", repeat=args.repeat,
+            )
+        )
+
+    if not args.skip_app:
+        # app.py loads the build from the working directory
+        results += measure_cold_start(repository, repeat=args.repeat)
+        sys.path.insert(0, repository)
+        # Results cached in this process only and no precomputed figures
+        os.environ.pop("BIKE_CACHE_DIR", None)
+        os.environ["BIKE_FIGURES_DIR"] = ""
+        app = importlib.import_module("app")
+        for timeframe, radialrange in [("hour_str", "max"), ("month_name", "median")]:
+            results += measure_callback(
+                f"app.update_fig[{timeframe}, {radialrange}]", app,
+                app.update_fig, [last_year], station, timeframe, radialrange, repeat=args.repeat,
+            )
+        results += measure_callback(
+            "app.update_fig[all years]", app,
+            app.update_fig, years, station, "hour_str", "max", repeat=args.repeat,
+        )
+        for aggregation in ["sum", "mean", "p95"]:
+            results += measure_callback(
+                f"app.update_comparison_fig[{aggregation}]", app,
+                app.update_comparison_fig, [last_year], station, aggregation, repeat=args.repeat,
+            )
+        for frequency in ["Day", "Month"]:
+            results += measure_callback(
+                f"app.update_barchart_fig[{frequency}]", app,
+                app.update_barchart_fig, street, frequency, None, repeat=args.repeat,
+            )
+        results += measure_callback(
+            "app.update_barchart_store", app,
+            app.update_barchart_store, street, repeat=args.repeat,
+        )
+        # json api on the sqlite store, a full page of every frequency
+        client = app.server.test_client()
+        for frequency in ["H", "D", "M"]:
+            url = f"/api/counts?station={stations.station.iloc[0]}&freq={frequency}&limit={MAX_PAGE_SIZE}"
+            assert client.get(url).status_code == 200
+            results.append(
+                measure(f"app /api/counts[{frequency}]", client.get, url, repeat=args.repeat)
+            )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stations", type=int, default=26)
+    parser.add_argument("--first-year", type=int, default=2017)
+    parser.add_argument("--last-year", type=int, default=2019)
+    parser.add_argument("--noise", type=float, default=0.3, help="log-normal noise of the counts")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-app", action="store_true", help="do not time the app.py callbacks")
+    parser.add_argument("--output", help="json file for the results")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {
+                    "commit": git_commit(),
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "config": vars(args),
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
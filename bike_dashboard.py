@@ -3,29 +3,28 @@
 import dash
 import dash_html_components as html
 import dash_core_components as dcc
-import pandas as pd
 import plotly.graph_objects as go
 import plotly.express as px
 from dash.dependencies import Input, Output
 
 from barchart_helper import (
     Frequency,
-    prepare_dataframe,
     get_parts_for_barchart,
     frequency_dict,
     streets_dict,
 )
-from comparison_helper import ComparisonBetweenStations, prepare_comparison_df, aggregate, map_colors
+from comparison_helper import ComparisonBetweenStations, aggregate, map_colors
+from dataset_helper import load_compact_dataset
 from polar_helper import prepare_data_for_polar
 
 external_stylesheets = ["https://codepen.io/chriddyp/pen/bWLwgP.css"]
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 
-# Read in the data and transform
-df = pd.read_csv("berlin_bikedata_2017-2019.csv")
-prepare_dataframe(df)
-comparison_df = df.set_index("timestamp")
+# Read in hourly counts with integer station codes and the station table
+data = load_compact_dataset()
+df = data.counts
+stations = data.stations
 
 # Create empty figures
 comparison_fig = go.Figure()
@@ -68,7 +67,7 @@ app.layout = html.Div(
                                     id="station-dropdown",
                                     options=[
                                         {"label": item, "value": item}
-                                        for item in df["description"].unique().tolist()
+                                        for item in stations["description"].tolist()
                                     ],
                                     clearable=False,
                                     multi=False,
@@ -234,21 +233,21 @@ def update_fig(year, station, timeframe, radialrange):
     is_year = df["year"].isin(year)
     complete_df = df[is_year]
     category_sorters = {"day_name": "weekday", "hour_str": "hour", "month_name": "month"}
-    df_median, df_max, radialrange_dict, categories = prepare_data_for_polar(
-        complete_df, timeframe, category_sorters, station
+    stats_df, radialrange_dict, categories = prepare_data_for_polar(
+        complete_df, timeframe, category_sorters, station, stations
     )
 
     fig = go.Figure()
 
     fig.add_trace(
         go.Scatterpolar(
-            r=df_max["total_bikes"],
+            r=stats_df["max"],
             theta=categories,
             fill="toself",
             name="max",
             fillcolor="lightgreen",
             mode="markers",
-            text=df_max["location"],
+            text=stats_df["location"],
             marker_color="lightgreen",
             hovertemplate="<b>%{text}</b><br><i>%{theta}</i><br><br>Max: %{r} bikes<extra></extra>",
         )
@@ -256,14 +255,14 @@ def update_fig(year, station, timeframe, radialrange):
 
     fig.add_trace(
         go.Scatterpolar(
-            r=df_median["total_bikes"],
+            r=stats_df["median"],
             theta=categories,
             fill="toself",
             name="median",
             fillcolor="dodgerblue",
             mode="markers",
             marker_color="dodgerblue",
-            text=df_median["location"],
+            text=stats_df["location"],
             hovertemplate="<b>%{text}</b><br><i>%{theta}</i><br><br>Median: %{r} bikes<extra></extra>",
         )
     )
@@ -291,7 +290,7 @@ def update_fig(year, station, timeframe, radialrange):
         aggregation_type = "mean"
         x_label = "Average Bikes"
     comparison = ComparisonBetweenStations(year, aggregation_type)
-    agg_comp_df = aggregate(comparison_df, comparison)
+    agg_comp_df = aggregate(df, comparison, stations)
     stations_list, color_map = map_colors(agg_comp_df, station)
 
     # Bar chart with total or average bikes by year and bicycle counter
@@ -334,7 +333,7 @@ def update_fig(year, station, timeframe, radialrange):
 def update_barchart_fig(street, frequency):
     """updates bar chart"""
     barchart_object = Frequency(frequency, frequency_dict, street)
-    barchart_df, barchart_title = get_parts_for_barchart(df, barchart_object)
+    barchart_df, barchart_title = get_parts_for_barchart(df, barchart_object, stations)
     barchart_fig = px.bar(
         barchart_df[barchart_df.station_short == barchart_object.location_id],
         x="timestamp",
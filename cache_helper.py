@@ -0,0 +1,276 @@
+"""helper functions for caching callback results"""
+
+import functools
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from plotly.basedatatypes import BaseFigure
+from plotly.io.json import to_json_plotly
+
+CACHE_SIZE = int(os.environ.get("BIKE_CACHE_SIZE", "128"))
+# directory shared by all workers on a host, results are only cached per process if unset
+CACHE_DIR = os.environ.get("BIKE_CACHE_DIR")
+FIGURES_PATH = "berlin_bikedata_2017-2019_figures"
+# directory of the results written by precompute.py
+FIGURES_DIR = os.environ.get("BIKE_FIGURES_DIR", FIGURES_PATH)
+
+
+class LRUCache:
+    """in-memory cache holding at most maxsize results, evicting the least recently used
+
+    A lock guards the entries and counters, callbacks of several threads share the cache.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """returns cached result or None"""
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        """stores result and evicts the least recently used one if full"""
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        """removes all results"""
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        """returns hit and miss counters and current size"""
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.entries)}
+
+
+class DiskCache(LRUCache):
+    """cache of pickled results in a directory shared by several processes
+
+    Files are written under a temporary name and renamed into place. Reading
+    an entry updates its modification time, the oldest files are evicted.
+    Counters are kept per process.
+    """
+
+    def __init__(self, directory, maxsize=CACHE_SIZE, version=""):
+        super().__init__(maxsize)
+        self.directory = directory
+        self.version = version
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr((self.version, key)).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.pickle")
+
+    def get(self, key):
+        """returns cached result or None"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                value = pickle.load(file)
+            os.utime(path)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return value
+
+    def set(self, key, value):
+        """stores result and evicts the least recently used files if full"""
+        path = self._path(key)
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+        entries = self._entries()
+        for name in sorted(entries, key=entries.get)[: max(len(entries) - self.maxsize, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        """removes all cached files"""
+        for name in self._entries():
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+
+    def _entries(self):
+        """returns modification times of the cached files"""
+        entries = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                try:
+                    entries[name] = os.stat(os.path.join(self.directory, name)).st_mtime_ns
+                except FileNotFoundError:
+                    pass
+        return entries
+
+    def info(self):
+        """returns hit and miss counters of this process and current size"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries())}
+
+
+class FigureStore:
+    """callback results precomputed by precompute.py as json files
+
+    The store is only used for the data version it was written for.
+    """
+
+    def __init__(self, directory, version=""):
+        self.directory = directory
+        self.version = version
+        self.hits = 0
+
+    def _path(self, key):
+        digest = hashlib.sha256(repr(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.json")
+
+    def is_current(self):
+        """returns whether the store was written for the current data version"""
+        try:
+            with open(os.path.join(self.directory, "_version.json")) as file:
+                return json.load(file)["version"] == self.version
+        except (OSError, ValueError, KeyError):
+            return False
+
+    def get(self, key):
+        """returns precomputed result or None"""
+        try:
+            with open(self._path(key)) as file:
+                value = json.load(file)
+        except OSError:
+            return None
+        self.hits += 1
+        return value
+
+    def write(self, key, value):
+        """stores result as json"""
+        path = self._path(key)
+        with open(f"{path}.{os.getpid()}.tmp", "w") as file:
+            file.write(to_json_plotly(value))
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def write_version(self):
+        """marks the store as complete for the current data version"""
+        with open(os.path.join(self.directory, "_version.json"), "w") as file:
+            json.dump({"version": self.version}, file)
+
+
+class LayeredCache:
+    """looks results up in a cache first and in a store of precomputed results on a miss"""
+
+    def __init__(self, cache, store):
+        self.cache = cache
+        self.store = store
+
+    def get(self, key):
+        """returns cached or precomputed result or None"""
+        value = self.cache.get(key)
+        if value is None:
+            value = self.store.get(key)
+        return value
+
+    def set(self, key, value):
+        """stores result in the cache"""
+        self.cache.set(key, value)
+
+    def clear(self):
+        """removes all cached results, the precomputed ones are kept"""
+        self.cache.clear()
+
+    def info(self):
+        """returns counters of the cache and hits of the precomputed results"""
+        return dict(self.cache.info(), precomputed=self.store.hits)
+
+
+def make_cache(version=""):
+    """returns disk cache if BIKE_CACHE_DIR is set, in-memory cache otherwise
+
+    Results precomputed for the current data version are served on a cache miss.
+    """
+    cache = DiskCache(CACHE_DIR, version=version) if CACHE_DIR else LRUCache()
+    store = FigureStore(FIGURES_DIR, version)
+    if FIGURES_DIR and store.is_current():
+        return LayeredCache(cache, store)
+    return cache
+
+
+def files_version(*paths):
+    """returns string changing whenever one of the existing files is rewritten"""
+    return ":".join(str(os.stat(path).st_mtime_ns) for path in paths if os.path.exists(path))
+
+
+def normalize_years(years):
+    """returns selected years as sorted list of unique integers"""
+    return sorted({int(year) for year in years})
+
+
+def plain_figures(result):
+    """returns callback result with plotly figures converted to dicts
+
+    Dicts are serialized by Dash just like figures but pickle and load much faster.
+    """
+    if isinstance(result, tuple):
+        return tuple(plain_figures(item) for item in result)
+    if isinstance(result, BaseFigure):
+        return result.to_dict()
+    return result
+
+
+def memoize(cache, normalize):
+    """caches results of a callback, figures are returned as dicts
+
+    normalize maps the callback arguments to a tuple of normalized arguments,
+    which is used as cache key and passed to the callback on a miss.
+    """
+
+    def decorator(function):
+        def normalized_key(normalized):
+            return (function.__name__,) + tuple(
+                tuple(item) if isinstance(item, list) else item for item in normalized
+            )
+
+        def key(*args):
+            """returns cache key of the callback arguments"""
+            return normalized_key(normalize(*args))
+
+        def compute(*args):
+            """returns result of the callback without looking it up in the cache"""
+            return plain_figures(function(*normalize(*args)))
+
+        @functools.wraps(function)
+        def wrapper(*args):
+            normalized = normalize(*args)
+            result = cache.get(normalized_key(normalized))
+            if result is None:
+                result = plain_figures(function(*normalized))
+                cache.set(normalized_key(normalized), result)
+            return result
+
+        wrapper.cache = cache
+        wrapper.key = key
+        wrapper.compute = compute
+        return wrapper
+
+    return decorator
@@ -2,6 +2,9 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+from cube_helper import daily_totals
+from dataset_helper import load_compact_dataset, with_descriptions
+
 
 class ComparisonBetweenStations:
     """Parameters for comparison between stations"""
@@ -17,34 +20,80 @@ class ComparisonBetweenStations:
         self.aggregation = aggregation
 
 
-def prepare_comparison_df(df):
-    """updates dataframe for barchart"""
-    df["timestamp"] = pd.to_datetime(df["timestamp"])
-    df.set_index("timestamp", inplace=True)
-    return df
-
-
-def aggregate(df, comparison):
-    """returns aggregated dataframe"""
+# Aggregations of the comparison chart with their dropdown and axis labels. Statistics
+# of single days count the days with data, the mean every day of the selected years
+# between the first and the last day with data, just like resampling the hourly counts to days.
+AGGREGATIONS = {
+    "sum": {"label": "total", "axis": "Total Bikes"},
+    "mean": {"label": "mean day", "axis": "Average Bikes"},
+    "median": {"label": "median day", "axis": "Median Bikes per Day"},
+    "p95": {"label": "95th percentile day", "axis": "Bikes per Day (95th Percentile)"},
+    "max": {"label": "busiest day", "axis": "Bikes on the Busiest Day"},
+    "weekday_mean": {"label": "mean weekday", "axis": "Average Bikes per Weekday"},
+    "weekend_mean": {"label": "mean weekend day", "axis": "Average Bikes per Weekend Day"},
+}
+
+
+def selected_days(daily, years):
+    """returns number of days of the selected years between the first and last day of each station
+
+    Years between selected ones, like 2018 in 2017/2019, do not count.
+    """
+    span = daily.index.to_series(index=daily.station_code).groupby(level=0).agg(["min", "max"])
+    days = 0
+    for year in years:
+        first = span["min"].clip(lower=pd.Timestamp(year=year, month=1, day=1))
+        last = span["max"].clip(upper=pd.Timestamp(year=year, month=12, day=31))
+        days = days + ((last - first).dt.days + 1).clip(lower=0)
+    return days
+
+
+def aggregate_daily(daily, comparison):
+    """returns aggregation of the daily totals per station code for the selected years"""
+    daily = daily[daily.year.isin(comparison.years)]
+    if comparison.aggregation == "weekday_mean":
+        daily = daily[daily.weekday < 5]
+    elif comparison.aggregation == "weekend_mean":
+        daily = daily[daily.weekday >= 5]
+    grouped = daily.groupby("station_code", observed=True)
     if comparison.aggregation == "sum":
-        bikes_df = (
-            df[df.index.year.isin(comparison.years)]
-            .groupby("description")[["total_bikes"]]
-            .sum()
-            .sort_values("total_bikes", ascending=True)
-        )
+        bikes = grouped.total_bikes.sum()
     elif comparison.aggregation == "mean":
-        bikes_df = (
-            df[df.index.year.isin(comparison.years)]
-            .groupby("description")[["total_bikes"]]
-            .resample("D")
-            .sum()
-            .reset_index()
-            .groupby("description")[["total_bikes"]]
-            .mean()
-            .sort_values("total_bikes", ascending=True)
-        )
-    return bikes_df
+        bikes = grouped.total_bikes.sum() / selected_days(daily, comparison.years)
+    elif comparison.aggregation == "median":
+        bikes = grouped.total_bikes.median()
+    elif comparison.aggregation == "p95":
+        bikes = grouped.total_bikes.quantile(0.95)
+    elif comparison.aggregation == "max":
+        bikes = grouped.total_bikes.max()
+    else:
+        bikes = grouped.total_bikes.mean()
+    return bikes.to_frame("total_bikes")
+
+
+def aggregate_per_code(df, comparison, cube=None):
+    """returns aggregation of total bikes per station code
+
+    Uses the daily totals of the rollup cube if one is given, the daily totals of
+    the hourly counts otherwise.
+    """
+    if cube is not None and comparison.aggregation == "sum":
+        yearly = cube.yearly[cube.yearly.year.isin(comparison.years)]
+        return yearly.groupby("station_code", observed=True)[["total_bikes"]].sum()
+    daily = cube.daily if cube is not None else daily_totals(df).set_index("timestamp")
+    return aggregate_daily(daily, comparison)
+
+
+def aggregate(df, comparison, stations, cube=None):
+    """returns aggregated dataframe indexed by station description"""
+    bikes_df = aggregate_per_code(df, comparison, cube)
+    return with_descriptions(bikes_df, stations).sort_values("total_bikes", ascending=True)
+
+
+def aggregate_from_engine(engine, comparison, stations):
+    """returns aggregated dataframe indexed by station description, queried with a query engine"""
+    bikes_df = engine.station_totals(comparison.years, comparison.aggregation)
+    return with_descriptions(bikes_df, stations).sort_values("total_bikes", ascending=True)
 
 
 def get_key(my_dict, val):
@@ -67,10 +116,9 @@ def map_colors(dataframe, station_name):
 
 
 if __name__ == "__main__":
-    df = pd.read_csv("berlin_bikedata_2017-2019.csv")
-    prepare_comparison_df(df)
+    data = load_compact_dataset()
     comparison = ComparisonBetweenStations([2019], "mean")
-    bikes_df = aggregate(df, comparison)
+    bikes_df = aggregate(data.counts, comparison, data.stations)
 
     # Set general style for plotly graphs
     px.defaults.template = "ggplot2"
@@ -0,0 +1,118 @@
+"""helper functions for the rollup cube of per-station aggregates built at ingest time"""
+
+import os
+import shutil
+
+import pandas as pd
+
+from dataset_helper import DATASET_PATH, dataset_years, load_dataset, optimize_dtypes
+from polar_helper import polar_statistics
+
+CUBE_PATH = "berlin_bikedata_2017-2019_cube"
+CUBE_TABLES = ["yearly", "daily", "profiles"]
+PROFILE_SORTERS = ["hour", "weekday", "month"]
+
+
+class RollupCube:
+    """per-station yearly sums, daily totals and hour/weekday/month quantiles, means and maxima"""
+
+    def __init__(self, yearly, daily, profiles):
+        self.yearly = yearly
+        self.daily = daily
+        self.profiles = profiles
+
+
+def daily_totals(df):
+    """returns total bikes per station and day with integer year and weekday keys"""
+    daily = (
+        df.groupby(["station_code", df.index.normalize().rename("timestamp")], observed=True)[
+            ["total_bikes"]
+        ]
+        .sum()
+        .reset_index()
+    )
+    daily["year"] = daily.timestamp.dt.year
+    daily["weekday"] = daily.timestamp.dt.weekday
+    return optimize_dtypes(daily)
+
+
+def build_cube(df):
+    """returns dict of rollup tables for a long table indexed by timestamp"""
+    yearly = (
+        df.groupby(["station_code", "year"], observed=True)[["total_bikes"]].sum().reset_index()
+    )
+    daily = daily_totals(df)
+    profiles = []
+    for sorter in PROFILE_SORTERS:
+        profile = (
+            polar_statistics(df, ["station_code", "year", sorter])
+            .astype({"max": "int32"})
+            .rename(columns={sorter: "value"})
+        )
+        profile.insert(2, "sorter", sorter)
+        profiles.append(profile)
+    return {
+        "yearly": optimize_dtypes(yearly),
+        "daily": daily,
+        "profiles": optimize_dtypes(pd.concat(profiles, ignore_index=True)),
+    }
+
+
+def build_cube_from_dataset(path=DATASET_PATH, years=None, cube_path=CUBE_PATH):
+    """returns rollup tables of the parquet dataset, reading one year at a time
+
+    With years given, only these years are read and the rows of the other
+    years are taken from the existing cube.
+    """
+    all_years = dataset_years(path)
+    read_years = all_years
+    parts = []
+    if years is not None and os.path.exists(cube_path):
+        read_years = [year for year in all_years if year in years]
+        kept_years = [year for year in all_years if year not in years]
+        previous = {
+            table: pd.read_parquet(os.path.join(cube_path, f"{table}.parquet"))
+            for table in CUBE_TABLES
+        }
+        parts.append({table: df[df.year.isin(kept_years)] for table, df in previous.items()})
+    parts += [
+        build_cube(
+            load_dataset(
+                columns=["station_code", "total_bikes"] + PROFILE_SORTERS + ["year"],
+                years=[year],
+                path=path,
+            )
+        )
+        for year in read_years
+    ]
+    # Rows in year order like a cube built from all years
+    return {
+        table: optimize_dtypes(
+            pd.concat([part[table] for part in parts], ignore_index=True)
+            .sort_values("year", kind="stable")
+            .reset_index(drop=True)
+        )
+        for table in CUBE_TABLES
+    }
+
+
+def write_cube(cube, path=CUBE_PATH):
+    """writes rollup tables as parquet files"""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    for table in CUBE_TABLES:
+        cube[table].to_parquet(os.path.join(path, f"{table}.parquet"), index=False)
+
+
+def load_cube(path=CUBE_PATH):
+    """returns RollupCube keyed by station code, None if it has not been built"""
+    if not os.path.exists(path):
+        return None
+    tables = {}
+    for table in CUBE_TABLES:
+        tables[table] = optimize_dtypes(pd.read_parquet(os.path.join(path, f"{table}.parquet")))
+    tables["daily"] = tables["daily"].set_index("timestamp")
+    if "weekday" not in tables["daily"]:  # cubes built before the weekday key was added
+        tables["daily"]["weekday"] = tables["daily"].index.weekday.astype("int8")
+    return RollupCube(**tables)
@@ -1,71 +1,340 @@
+"""transforms the hourly counts of the source workbook into a long table"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from xml.etree import ElementTree
+
+import numpy as np
+import openpyxl
 import pandas as pd
 
+from cube_helper import build_cube, build_cube_from_dataset, write_cube
+from dataset_helper import (
+    DATASET_PATH,
+    DAY_NAMES,
+    HOUR_LABELS,
+    MONTH_NAMES,
+    append_partition,
+    replace_partition,
+    replace_partition_from_chunks,
+    write_dataset,
+)
+from matrix_helper import write_count_matrix
+from station_helper import StationRegistry, load_station_registry, write_station_registry
+from store_helper import write_store
+
+WORKBOOK_PATH = "gesamtdatei_stundenwerte_2012-2019.xlsx"
+MANIFEST_NAME = "_manifest.json"
+# xml namespaces of the workbook part and of its relationships
+SPREADSHEET_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIPS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
 
-def create_yearly_table(df):
-    """reads in source csv file, transforms data and merges with locations table"""
-    df.rename(columns={"Zählstelle        Inbetriebnahme": "timestamp"}, inplace=True)
-    df.timestamp = pd.to_datetime(df.timestamp).copy()
-    stacked = df.stack().reset_index()
-    merged = pd.merge(
-        stacked, df.timestamp.reset_index(), "left", left_on="level_0", right_on="index"
-    ).drop(columns=["level_0", "index"])
-    temp_df = (
-        merged[merged.level_1 != "timestamp"]
-        .set_index("timestamp")
-        .rename(columns={"level_1": "station", 0: "total_bikes"})
+logger = logging.getLogger(__name__)
+
+
+def create_yearly_table(df, registry):
+    """reads in source csv file, transforms data and replaces station ids by registry codes"""
+    df = df.rename(columns={"Zählstelle        Inbetriebnahme": "timestamp"})
+    timestamps = pd.to_datetime(df.timestamp).to_numpy()
+    counts = df.drop(columns="timestamp")
+    # station ids are parsed once per column, rows are matched by position
+    station_codes = registry.codes(counts.columns.str[:-11])
+    n_rows, n_columns = counts.shape
+    values = counts.to_numpy(dtype=float).ravel()
+    is_counted = ~np.isnan(values)
+    row_positions = np.repeat(np.arange(n_rows), n_columns)[is_counted]
+    column_positions = np.tile(np.arange(n_columns), n_rows)[is_counted]
+    temp_df = pd.DataFrame(
+        {
+            "station_code": station_codes[column_positions],
+            "total_bikes": values[is_counted].astype(int),
+        },
+        index=pd.DatetimeIndex(timestamps[row_positions], name="timestamp"),
     )
-    temp_df["total_bikes"] = temp_df["total_bikes"].astype(int).copy()
-    temp_df.station = temp_df.station.str[:-11].copy()
-    temp_df.station = temp_df.station.str.strip().copy()
-    temp_df.station.replace("17-SZ-BRE-O", "17-SK-BRE-O", inplace=True)
-    temp_df.station.replace("17-SZ-BRE-W", "17-SK-BRE-W", inplace=True)
     temp_df["hour"] = temp_df.index.hour
-    temp_df["hour_str"] = temp_df.hour.astype(str) + " Uhr"
-    temp_df["weekday"] = temp_df.index.weekday.copy()
-    temp_df["day_name"] = temp_df.index.day_name().copy()
-    temp_df["month"] = temp_df.index.month.copy()
-    temp_df["month_name"] = temp_df.index.month_name().copy()
-    temp_df["year"] = temp_df.index.year.copy()
-    final_geo = (
-        pd.merge(
-            temp_df.reset_index(),
-            locations.drop(columns="Installationsdatum"),
-            "left",
-            left_on="station",
-            right_on="Zählstelle",
-        )
-        .drop(columns=["Zählstelle"])
-        .rename(
-            columns={
-                "Beschreibung - Fahrtrichtung": "description",
-                "Breitengrad": "lat",
-                "Längengrad": "lon",
-            }
-        )
-        .set_index("timestamp")
-    )
-    return final_geo
+    temp_df["hour_str"] = HOUR_LABELS[temp_df.hour.to_numpy()]
+    temp_df["weekday"] = temp_df.index.weekday
+    temp_df["day_name"] = DAY_NAMES[temp_df.weekday.to_numpy()]
+    temp_df["month"] = temp_df.index.month
+    temp_df["month_name"] = MONTH_NAMES[temp_df.month.to_numpy()]
+    temp_df["year"] = temp_df.index.year
+    return temp_df
 
 
-def transform_concat_dataframes(dataframes_list):
+def transform_concat_dataframes(dataframes_list, registry):
     """transform all loaded dataframes and concat them"""
     processed_dataframes = []
     for dataframe in dataframes_list:
-        processed_dataframes.append(create_yearly_table(dataframe))
+        processed_dataframes.append(create_yearly_table(dataframe, registry))
     return pd.concat(processed_dataframes)
 
 
+def read_year_sheet(path, year):
+    """reads the hourly counts of one year from the source workbook"""
+    return pd.read_excel(path, sheet_name=f"Jahresdatei {year}")
+
+
+def read_year_sheet_chunks(path, year, chunk_rows):
+    """yields the hourly counts of one year in tables of at most chunk_rows rows
+
+    The sheet is streamed row by row, so it is never loaded as a whole.
+    """
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = workbook[f"Jahresdatei {year}"].iter_rows(values_only=True)
+        header = next(rows)
+        chunk = []
+        for row in rows:
+            if row[0] is None:
+                continue
+            chunk.append(row)
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+
+def read_sheet_station_ids(path, year):
+    """returns the station ids in the header of one year sheet"""
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        header = next(workbook[f"Jahresdatei {year}"].iter_rows(max_row=1, values_only=True))
+    finally:
+        workbook.close()
+    return [str(item)[:-11] for item in header[1:] if item is not None]
+
+
+def ingest_year(path, year, registry):
+    """reads and transforms one year sheet"""
+    return create_yearly_table(read_year_sheet(path, year), registry)
+
+
+def ingest_workbook(path, years, registry, workers=1):
+    """reads and transforms the year sheets and concats them in year order
+
+    With more than one worker, each sheet is read and transformed in its own process.
+    Stations of all sheets are registered beforehand, so every worker assigns the same codes.
+    """
+    years = sorted(years)
+    if workers > 1:
+        for year in years:
+            registry.codes(read_sheet_station_ids(path, year))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            tables = list(executor.map(ingest_year, repeat(path), years, repeat(registry)))
+    else:
+        tables = [ingest_year(path, year, registry) for year in years]
+    return pd.concat(tables)
+
+
+def ingest_streaming(path, years, registry, chunk_rows, dataset_path=DATASET_PATH):
+    """builds the parquet dataset chunk by chunk with bounded memory
+
+    Each chunk goes through create_yearly_table and is written as a row group
+    of its year partition before the next chunk is read. Every partition is
+    swapped in once it is complete, so readers keep seeing the previous dataset
+    until then. Partitions of years not in the workbook are removed at the end.
+    """
+    manifest = read_manifest(dataset_path)
+    # Rebuilt sheets are no longer described by the manifest, an incremental run rebuilds them
+    manifest["workbook_sha256"] = None
+    for year in sorted(years):
+        chunks = (
+            create_yearly_table(chunk, registry)
+            for chunk in read_year_sheet_chunks(path, year, chunk_rows)
+        )
+        replace_partition_from_chunks(chunks, year, dataset_path)
+        manifest["sheets"].pop(f"Jahresdatei {year}", None)
+        write_manifest(manifest, dataset_path)
+    for name in os.listdir(dataset_path):
+        if name.startswith("year=") and int(name[5:]) not in years:
+            shutil.rmtree(os.path.join(dataset_path, name))
+
+
+def file_digest(path):
+    """returns sha256 of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sheet_digest(sheet, n_rows=None):
+    """returns sha256 over the column names and the first n_rows rows of a year sheet
+
+    Counts are hashed as floats, so appending rows with gaps does not change
+    the digest of the rows before them.
+    """
+    rows = sheet.iloc[:n_rows]
+    normalized = rows.iloc[:, 1:].astype(float)
+    normalized.insert(0, "timestamp", pd.to_datetime(rows.iloc[:, 0]))
+    digest = hashlib.sha256("\n".join(map(str, sheet.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(normalized, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def sheet_part_digests(path):
+    """returns sha256 of the xml part of every sheet of the workbook by sheet name
+
+    The parts are only decompressed, not parsed into cells. Cells refer to the
+    shared strings and styles, so these parts are hashed into every sheet.
+    """
+    with zipfile.ZipFile(path) as workbook:
+        relationships = ElementTree.fromstring(workbook.read("xl/_rels/workbook.xml.rels"))
+        targets = {item.get("Id"): item.get("Target") for item in relationships}
+        shared = hashlib.sha256()
+        for name in ["xl/sharedStrings.xml", "xl/styles.xml"]:
+            if name in workbook.namelist():
+                shared.update(workbook.read(name))
+        digests = {}
+        sheets = ElementTree.fromstring(workbook.read("xl/workbook.xml"))
+        for sheet in sheets.iter(f"{{{SPREADSHEET_NS}}}sheet"):
+            target = targets[sheet.get(f"{{{RELATIONSHIPS_NS}}}id")]
+            # Targets are relative to xl/ or absolute within the zip
+            part = target[1:] if target.startswith("/") else f"xl/{target}"
+            digest = shared.copy()
+            with workbook.open(part) as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    digest.update(block)
+            digests[sheet.get("name")] = digest.hexdigest()
+    return digests
+
+
+def read_manifest(dataset_path=DATASET_PATH):
+    """returns build manifest of the dataset, empty if there is none"""
+    manifest_path = os.path.join(dataset_path, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"workbook_sha256": None, "sheets": {}}
+    with open(manifest_path) as file:
+        return json.load(file)
+
+
+def write_manifest(manifest, dataset_path=DATASET_PATH):
+    """writes build manifest of the dataset atomically"""
+    os.makedirs(dataset_path, exist_ok=True)
+    manifest_path = os.path.join(dataset_path, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w") as file:
+        json.dump(manifest, file, indent=2)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+
+def ingest_incremental(path, years, registry, dataset_path=DATASET_PATH, workers=1):
+    """updates the parquet dataset with new or changed year sheets only
+
+    Sheets whose xml part matches the manifest are skipped without parsing them.
+    The other sheets are read, with more than one worker each in its own process.
+    If a sheet only gained rows at the end, just the new hours are transformed and
+    appended to its partition, if its counts changed the partition of that year is rebuilt.
+    Returns the set of years whose partition changed.
+    """
+    manifest = read_manifest(dataset_path)
+    workbook_sha256 = file_digest(path)
+    # An unchanged workbook only needs no work if all requested sheets have been processed
+    if manifest["workbook_sha256"] == workbook_sha256 and all(
+        f"Jahresdatei {year}" in manifest["sheets"] for year in years
+    ):
+        logger.info("dataset is up to date")
+        return set()
+    part_digests = sheet_part_digests(path)
+    read_years = []
+    for year in sorted(years):
+        sheet_name = f"Jahresdatei {year}"
+        entry = manifest["sheets"].get(sheet_name)
+        if entry is not None and entry.get("xml_sha256") == part_digests.get(sheet_name):
+            logger.info("%s: unchanged", sheet_name)
+        else:
+            read_years.append(year)
+    if workers > 1 and len(read_years) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            sheets = list(executor.map(read_year_sheet, repeat(path), read_years))
+    else:
+        sheets = (read_year_sheet(path, year) for year in read_years)
+    changed_years = set()
+    for year, sheet in zip(read_years, sheets):
+        sheet_name = f"Jahresdatei {year}"
+        digest = sheet_digest(sheet)
+        entry = manifest["sheets"].get(sheet_name)
+        if entry is not None and entry["sha256"] == digest:
+            # The part was written differently, but holds the same counts
+            logger.info("%s: unchanged", sheet_name)
+        elif (
+            entry is not None
+            and len(sheet) > entry["rows"]
+            and sheet_digest(sheet, entry["rows"]) == entry["sha256"]
+        ):
+            new_rows = sheet.iloc[entry["rows"]:]
+            append_partition(create_yearly_table(new_rows, registry), year, dataset_path)
+            logger.info("%s: appended %d hours", sheet_name, len(new_rows))
+            changed_years.add(year)
+        else:
+            replace_partition(create_yearly_table(sheet, registry), year, dataset_path)
+            logger.info("%s: rebuilt %d hours", sheet_name, len(sheet))
+            changed_years.add(year)
+        manifest["sheets"][sheet_name] = {
+            "rows": len(sheet),
+            "sha256": digest,
+            "xml_sha256": part_digests.get(sheet_name),
+        }
+        write_manifest(manifest, dataset_path)
+    manifest["workbook_sha256"] = workbook_sha256
+    write_manifest(manifest, dataset_path)
+    return changed_years
+
+
 if __name__ == "__main__":
-    locations = pd.read_excel(
-        "gesamtdatei_stundenwerte_2012-2019.xlsx", sheet_name="Standortdaten"
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--workbook", default=WORKBOOK_PATH)
+    parser.add_argument("--first-year", type=int, default=2017)
+    parser.add_argument("--last-year", type=int, default=2019)
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of processes reading year sheets"
     )
-    dataframes = []
-    for year in range(2017, 2020):
-        dataframes.append(
-            pd.read_excel(
-                "gesamtdatei_stundenwerte_2012-2019.xlsx",
-                sheet_name=f"Jahresdatei {year}",
-            )
-        )
-    final_table = transform_concat_dataframes(dataframes)
-    final_table.to_csv("berlin_bikedata_2017-2019.csv")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only update the parquet dataset with new or changed sheets, no csv is written",
+    )
+    parser.add_argument(
+        "--chunk-rows",
+        type=int,
+        help="stream each sheet in chunks of this many hours into the parquet dataset, "
+        "no csv is written",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    locations = pd.read_excel(args.workbook, sheet_name="Standortdaten")
+    # incremental builds keep the station codes of the existing dataset
+    previous = load_station_registry() if args.incremental else None
+    registry = StationRegistry.from_locations(locations, previous=previous)
+    years = range(args.first_year, args.last_year + 1)
+    # Years whose rows of the derived files are rebuilt, None for all years
+    changed_years = None
+    if args.incremental:
+        changed_years = ingest_incremental(args.workbook, years, registry, workers=args.workers)
+    elif args.chunk_rows:
+        ingest_streaming(args.workbook, years, registry, args.chunk_rows)
+        write_cube(build_cube_from_dataset())
+    else:
+        final_table = ingest_workbook(args.workbook, years, registry, workers=args.workers)
+        registry.with_station_columns(final_table).to_csv("berlin_bikedata_2017-2019.csv")
+        write_dataset(final_table)
+        write_cube(build_cube(final_table))
+    if changed_years == set() and previous is not None and registry.stations.equals(previous.stations):
+        logger.info("station registry, cube, count matrix and store are up to date")
+    else:
+        if changed_years:
+            write_cube(build_cube_from_dataset(years=changed_years))
+        write_station_registry(registry)
+        write_count_matrix(registry.stations, years=changed_years)
+        write_store(registry.stations, years=changed_years)
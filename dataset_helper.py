@@ -0,0 +1,272 @@
+"""helper functions for storing and loading the prepared bike data"""
+
+import calendar
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from station_helper import STATIONS_PATH, load_station_registry
+
+DATASET_PATH = "berlin_bikedata_2017-2019.parquet"
+CSV_PATH = "berlin_bikedata_2017-2019_reduced.csv"
+
+CATEGORY_COLUMNS = ["station", "description", "hour_str", "day_name", "month_name", "sorter"]
+DTYPES = {
+    "station_code": "int8",
+    "total_bikes": "int32",
+    "station_short": "int8",
+    "hour": "int8",
+    "weekday": "int8",
+    "month": "int8",
+    "year": "int16",
+    "lat": "float32",
+    "lon": "float32",
+}
+STATION_COLUMNS = ["station", "description", "station_short", "lat", "lon"]
+COUNT_COLUMNS = ["total_bikes", "hour", "weekday", "month", "year"]
+
+HOUR_LABELS = np.array([f"{hour} Uhr" for hour in range(24)], dtype=object)
+DAY_NAMES = np.array(list(calendar.day_name), dtype=object)
+MONTH_NAMES = np.array(list(calendar.month_name), dtype=object)
+CALENDAR_LABELS = {"hour_str": HOUR_LABELS, "day_name": DAY_NAMES, "month_name": MONTH_NAMES}
+
+
+class BackgroundLoad:
+    """runs a loading function in a daemon thread, get waits for its result
+
+    The load is started right away, so a server can answer requests not
+    needing the data while it runs. seconds holds the duration of the load.
+    """
+
+    def __init__(self, load):
+        self.load = load
+        self.result = None
+        self.error = None
+        self.seconds = None
+        self.done = threading.Event()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.result = self.load()
+        except BaseException as error:
+            self.error = error
+        self.seconds = time.perf_counter() - start
+        self.done.set()
+
+    def get(self):
+        """returns result of the load, raises its error if it failed"""
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class CompactDataset:
+    """hourly counts referencing a station table by integer station code"""
+
+    def __init__(self, counts, stations):
+        self.counts = counts
+        self.stations = stations
+
+
+def station_code(stations, description):
+    """returns code of the station with the given description"""
+    return stations.index[stations.description == description][0]
+
+
+def with_descriptions(df, stations):
+    """replaces station code index of an aggregated dataframe by the station descriptions"""
+    df.index = pd.Index(stations.description.loc[df.index].to_numpy(), name="description")
+    return df
+
+
+def calendar_labels(category, values):
+    """returns labels like "13 Uhr" or "Monday" for integer hours, weekdays or months"""
+    return CALENDAR_LABELS[category][np.asarray(values, dtype=int)]
+
+
+def add_station_short(df):
+    """adds numeric counter id shared by both directions of a street"""
+    df["station_short"] = df.station.astype(str).str.split("-", n=1).str[0].astype(int)
+    return df
+
+
+def optimize_dtypes(df):
+    """casts string columns to categoricals and numbers to the smallest dtype"""
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    for column, dtype in DTYPES.items():
+        if column in df.columns:
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def without_object_columns(df):
+    """returns table with string columns stored in arrow buffers instead of python objects
+
+    Forked workers reading the columns then never update reference counts of python
+    strings, which would copy the pages holding them from the parent process.
+    """
+    return df.astype(
+        {column: "string[pyarrow]" for column in df.columns if df[column].dtype == object}
+    )
+
+
+def write_dataset(df, path=DATASET_PATH):
+    """writes long table as parquet dataset partitioned by year"""
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    table = optimize_dtypes(df.reset_index())
+    table.to_parquet(
+        path, partition_cols=["year"], index=False, basename_template="part-00000-{i}.parquet"
+    )
+
+
+def _partition_table(df):
+    """returns table for one year partition, the year itself is kept in the path"""
+    return optimize_dtypes(df.reset_index()).drop(columns="year")
+
+
+def append_partition(df, year, path=DATASET_PATH):
+    """adds rows of one year to the dataset as a new file
+
+    The file is written under a hidden name and renamed into place,
+    so readers never see a partial file. File names sort in write order.
+    """
+    partition = os.path.join(path, f"year={year}")
+    os.makedirs(partition, exist_ok=True)
+    parts = [name for name in os.listdir(partition) if name.endswith(".parquet")]
+    name = f"part-{len(parts):05d}.parquet"
+    temporary = os.path.join(partition, f".{name}.tmp")
+    _partition_table(df).to_parquet(temporary, index=False)
+    os.replace(temporary, os.path.join(partition, name))
+
+
+def _swap_partition(temporary, year, path):
+    """moves a fully written hidden partition directory into place"""
+    partition = os.path.join(path, f"year={year}")
+    previous = os.path.join(path, f".year={year}.old")
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+    if os.path.exists(partition):
+        os.rename(partition, previous)
+    os.rename(temporary, partition)
+    if os.path.exists(previous):
+        shutil.rmtree(previous)
+
+
+def _temporary_partition(year, path):
+    """returns empty hidden directory for writing a partition"""
+    temporary = os.path.join(path, f".year={year}.tmp")
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+    os.makedirs(temporary)
+    return temporary
+
+
+def replace_partition(df, year, path=DATASET_PATH):
+    """replaces all rows of one year in the dataset
+
+    The new partition is written to a hidden directory and swapped in with renames.
+    """
+    temporary = _temporary_partition(year, path)
+    _partition_table(df).to_parquet(
+        os.path.join(temporary, "part-00000.parquet"), index=False
+    )
+    _swap_partition(temporary, year, path)
+
+
+def replace_partition_from_chunks(chunks, year, path=DATASET_PATH):
+    """replaces all rows of one year with chunks written as row groups of one file
+
+    Only one chunk is held in memory at a time.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    temporary = _temporary_partition(year, path)
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(_partition_table(chunk), preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(
+                    os.path.join(temporary, "part-00000.parquet"), table.schema
+                )
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+    _swap_partition(temporary, year, path)
+
+
+def dataset_years(path=DATASET_PATH):
+    """returns years of the partitions of the parquet dataset"""
+    return sorted(int(name[5:]) for name in os.listdir(path) if name.startswith("year="))
+
+
+def load_dataset(columns=None, years=None, path=DATASET_PATH, csv_path=CSV_PATH):
+    """returns dataset indexed by timestamp, reading only the given columns and years
+
+    Falls back to the csv file if no parquet dataset has been built yet.
+    """
+    if os.path.exists(path):
+        read_columns = None if columns is None else ["timestamp"] + list(columns)
+        filters = None if years is None else [("year", "in", [int(year) for year in years])]
+        df = pd.read_parquet(path, columns=read_columns, filters=filters)
+        df = optimize_dtypes(df.set_index("timestamp"))
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(kind="stable")
+    else:
+        df = pd.read_csv(csv_path, index_col="timestamp", parse_dates=True)
+        if "station_short" not in df.columns and "station" in df.columns:
+            add_station_short(df)
+        if years is not None:
+            df = df[df["year"].isin([int(year) for year in years])]
+        if columns is not None:
+            df = df[list(columns)]
+        df = optimize_dtypes(df.copy())
+    return df
+
+
+def compact_dataset(df):
+    """splits long table into numeric counts with station codes and a station table"""
+    station = df["station"].astype("category")
+    stations = (
+        df[STATION_COLUMNS]
+        .drop_duplicates("station")
+        .set_index("station")
+        .reindex(station.cat.categories)
+        .rename_axis("station")
+        .reset_index()
+    )
+    stations.index.name = "station_code"
+    stations["station"] = stations["station"].astype(str)
+    stations["description"] = stations["description"].astype(str)
+    counts = df[COUNT_COLUMNS].copy()
+    counts.insert(0, "station_code", station.cat.codes.astype("int8").to_numpy())
+    return CompactDataset(counts, stations)
+
+
+def load_compact_dataset(
+    years=None, path=DATASET_PATH, csv_path=CSV_PATH, stations_path=STATIONS_PATH
+):
+    """returns CompactDataset of the prepared bike data
+
+    The parquet dataset refers to the station registry by code, the csv file
+    carries the station columns in every row.
+    """
+    if os.path.exists(path):
+        counts = load_dataset(columns=["station_code"] + COUNT_COLUMNS, years=years, path=path)
+        return CompactDataset(counts, load_station_registry(stations_path).stations)
+    df = load_dataset(
+        columns=STATION_COLUMNS + COUNT_COLUMNS, years=years, path=path, csv_path=csv_path
+    )
+    return compact_dataset(df)
@@ -0,0 +1,33 @@
+"""gunicorn settings for serving app.py with several workers sharing the preloaded data
+
+    gunicorn -c gunicorn.conf.py app:server
+"""
+
+import gc
+import os
+
+bind = os.environ.get("BIKE_BIND", "0.0.0.0:8050")
+workers = int(os.environ.get("BIKE_WORKERS", "4"))
+pidfile = os.environ.get("BIKE_PIDFILE", "gunicorn.pid")
+# app.py and its data are loaded once in the master, the workers share its pages after fork
+preload_app = True
+# the data has to be loaded before forking, threads loading it would not run in the workers
+os.environ.setdefault("BIKE_LAZY_LOAD", "0")
+
+# no collections while the app is loaded in the master, they would leave freed
+# objects scattered over the pages the workers are going to share
+gc.disable()
+
+
+def when_ready(server):
+    """moves the objects of the preloaded app out of reach of the garbage collector
+
+    Collections in the workers would otherwise write to the pages of these objects
+    and copy them into every worker.
+    """
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    """collects garbage of the worker again, objects of the master stay frozen"""
+    gc.enable()
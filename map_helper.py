@@ -0,0 +1,149 @@
+"""helper functions for the station map page served from memory"""
+
+import gzip
+import hashlib
+import json
+from urllib.parse import quote
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, the map is served gzip compressed without it
+    brotli = None
+
+MAP_ROUTE = "/maps/stations.html"
+# Map urls carry the content hash, so browsers may keep the map for as long as they like
+MAX_AGE = 365 * 24 * 3600
+TILES = "https://stamen-tiles-{s}.a.ssl.fastly.net/toner/{z}/{x}/{y}.png"
+TILES_ATTRIBUTION = (
+    'Map tiles by <a href="http://stamen.com">Stamen Design</a>, under '
+    '<a href="http://creativecommons.org/licenses/by/3.0">CC BY 3.0</a>. Data by &copy; '
+    '<a href="http://openstreetmap.org">OpenStreetMap</a>, under '
+    '<a href="http://www.openstreetmap.org/copyright">ODbL</a>.'
+)
+MARKER_STYLE = {"color": "#3186cc", "fillColor": "#3186cc", "fillOpacity": 0.2, "radius": 10, "weight": 3}
+HIGHLIGHT_STYLE = {"color": "#e6550d", "fillColor": "#e6550d", "fillOpacity": 0.6, "radius": 14, "weight": 3}
+
+# Leaflet page with one marker per counter, the station in the url fragment is
+# centered and highlighted, changing the fragment does not reload the page
+MAP_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+<meta name="viewport" content="width=device-width, initial-scale=1.0, maximum-scale=1.0, user-scalable=no" />
+<script src="https://cdn.jsdelivr.net/npm/leaflet@1.6.0/dist/leaflet.js"></script>
+<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.6.0/dist/leaflet.css"/>
+<style>html, body, #map {width: 100%; height: 100%; margin: 0; padding: 0;}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var stations = __STATIONS__;
+var markerStyle = __MARKER_STYLE__;
+var highlightStyle = __HIGHLIGHT_STYLE__;
+var map = L.map("map", {center: [52.52, 13.405], zoom: 12});
+L.tileLayer("__TILES__", {attribution: __ATTRIBUTION__, maxZoom: 18}).addTo(map);
+var markers = {};
+stations.forEach(function (station) {
+    var tooltip = document.createElement("div");
+    tooltip.textContent = station.description;
+    markers[station.description] = L.circleMarker([station.lat, station.lon], markerStyle)
+        .bindTooltip(tooltip, {sticky: true})
+        .addTo(map);
+});
+var selected = null;
+function select(description) {
+    if (selected) {
+        selected.setStyle(markerStyle);
+    }
+    selected = markers[description] || null;
+    if (selected) {
+        selected.setStyle(highlightStyle).bringToFront();
+        map.setView(selected.getLatLng(), 15);
+    }
+}
+function selectFromHash() {
+    select(decodeURIComponent(window.location.hash.slice(1)));
+}
+window.addEventListener("hashchange", selectFromHash);
+selectFromHash();
+</script>
+</body>
+</html>
+"""
+
+
+def script_json(value):
+    """returns value as json that can be embedded in a script element"""
+    return json.dumps(value, ensure_ascii=False).replace("</", "<\\/")
+
+
+def station_map_html(stations):
+    """returns map page with a marker for every station that has coordinates"""
+    located = stations.dropna(subset=["lat", "lon"])
+    records = [
+        {"description": description, "lat": round(float(lat), 5), "lon": round(float(lon), 5)}
+        for description, lat, lon in zip(located.description, located.lat, located.lon)
+    ]
+    return (
+        MAP_PAGE.replace("__STATIONS__", script_json(records))
+        .replace("__MARKER_STYLE__", script_json(MARKER_STYLE))
+        .replace("__HIGHLIGHT_STYLE__", script_json(HIGHLIGHT_STYLE))
+        .replace("__TILES__", TILES)
+        .replace("__ATTRIBUTION__", script_json(TILES_ATTRIBUTION))
+    )
+
+
+class StationMap:
+    """html of the map page with its compressed encodings and strong etag"""
+
+    def __init__(self, html):
+        self.encodings = {"identity": html, "gzip": gzip.compress(html, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encodings["br"] = brotli.compress(html, quality=11)
+        self.etag = hashlib.sha256(html).hexdigest()[:16]
+
+    @classmethod
+    def from_stations(cls, stations):
+        """builds map page of the station table"""
+        return cls(station_map_html(stations).encode())
+
+    def preferred_encodings(self):
+        """returns compressed encodings of the page, smallest first"""
+        return [encoding for encoding in ["br", "gzip"] if encoding in self.encodings]
+
+
+def negotiate_encoding(encodings, etag):
+    """returns first of the encodings accepted by the request, identity if none is, and its strong etag
+
+    Strong etags differ between the encodings of a response.
+    """
+    accept_encoding = request.headers.get("Accept-Encoding", "")
+    accepted = {item.split(";")[0].strip() for item in accept_encoding.split(",")}
+    encoding = next((item for item in encodings if item in accepted), "identity")
+    return encoding, etag if encoding == "identity" else f"{etag}-{encoding}"
+
+
+def map_url(station_map, station, route=MAP_ROUTE):
+    """returns versioned url of the map page centered on a station"""
+    return f"{route}?v={station_map.etag}#{quote(station)}"
+
+
+def register_map_route(server, station_map, route=MAP_ROUTE):
+    """serves the map page from the flask server with compression and cache headers"""
+
+    def serve_map():
+        encoding, etag = negotiate_encoding(station_map.preferred_encodings(), station_map.etag)
+        headers = {
+            "ETag": f'"{etag}"',
+            "Cache-Control": f"public, max-age={MAX_AGE}, immutable",
+            "Vary": "Accept-Encoding",
+        }
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+        return Response(station_map.encodings[encoding], mimetype="text/html", headers=headers)
+
+    server.add_url_rule(route, "serve_map", serve_map)
@@ -0,0 +1,159 @@
+"""helper functions for the memory-mapped station x hour count matrix"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_helper import DATASET_PATH, dataset_years, load_dataset, optimize_dtypes
+
+MATRIX_PATH = "berlin_bikedata_2017-2019_counts.npy"
+MISSING = -1
+HOUR = pd.Timedelta(hours=1)
+
+
+def index_path(path):
+    """returns path of the side index of a count matrix"""
+    return os.path.splitext(path)[0] + ".json"
+
+
+class CountMatrix:
+    """hourly counts as stations x hours array, row i belongs to station code i
+
+    Hours without a count hold MISSING.
+    """
+
+    def __init__(self, counts, stations, origin):
+        self.counts = counts
+        self.stations = stations
+        self.origin = origin
+
+    def position(self, timestamp):
+        """returns column of the hour starting at timestamp, clipped to the matrix"""
+        position = (pd.Timestamp(timestamp) - self.origin) // HOUR
+        return int(min(max(position, 0), self.counts.shape[1]))
+
+    def year_range(self, year):
+        """returns first and past-the-end column of a year"""
+        return (
+            self.position(pd.Timestamp(year=year, month=1, day=1)),
+            self.position(pd.Timestamp(year=year + 1, month=1, day=1)),
+        )
+
+    def timestamps(self, start, stop):
+        """returns hours of the columns start to stop"""
+        return pd.date_range(self.origin + start * HOUR, periods=stop - start, freq="h")
+
+    def years(self):
+        """returns years covered by the matrix"""
+        last = self.origin + (self.counts.shape[1] - 1) * HOUR
+        return list(range(self.origin.year, last.year + 1))
+
+    def station_hours(self, code, years):
+        """returns counts and hours of one station in the given years, skipping missing hours
+
+        The counts of each year are read from a view into the matrix.
+        """
+        counts, hours = [], []
+        for year in sorted(set(years) & set(self.years())):
+            start, stop = self.year_range(year)
+            values = self.counts[code, start:stop]
+            is_counted = values != MISSING
+            counts.append(values[is_counted])
+            hours.append(self.timestamps(start, stop)[is_counted])
+        if not counts:
+            return np.array([], dtype=self.counts.dtype), pd.DatetimeIndex([])
+        return np.concatenate(counts), hours[0].append(hours[1:])
+
+    def to_counts(self):
+        """returns hourly counts as long table in the layout of CompactDataset.counts"""
+        positions, codes = np.nonzero(self.counts.T != MISSING)
+        timestamps = pd.DatetimeIndex(self.origin + positions * HOUR, name="timestamp")
+        counts = pd.DataFrame(
+            {
+                "station_code": codes,
+                "total_bikes": self.counts[codes, positions],
+                "hour": timestamps.hour,
+                "weekday": timestamps.weekday,
+                "month": timestamps.month,
+                "year": timestamps.year,
+            },
+            index=timestamps,
+        )
+        return optimize_dtypes(counts)
+
+
+def write_count_matrix(stations, dataset_path=DATASET_PATH, path=MATRIX_PATH, years=None):
+    """writes the counts of the parquet dataset as stations x hours matrix with a side index
+
+    Row i holds the counts of station code i of the station table. The dataset
+    is read one year at a time and written into a memory-mapped file.
+    Counts of duplicate hours are added up. With years given, only these years
+    are read and the columns of the other years are copied from the existing matrix.
+    """
+    all_years = dataset_years(dataset_path)
+    previous = None if years is None else load_count_matrix(path)
+    kept_years = [] if previous is None else [year for year in all_years if year not in years]
+    # Everything is read again if the existing matrix misses a kept year or has more stations
+    if previous is not None and (
+        not set(kept_years) <= set(previous.years()) or len(previous.counts) > len(stations)
+    ):
+        previous, kept_years = None, []
+    read_years = [year for year in all_years if year not in kept_years]
+
+    first, last = None, None
+    for year in read_years:
+        df = load_dataset(columns=["station_code"], years=[year], path=dataset_path)
+        first = df.index.min() if first is None else min(first, df.index.min())
+        last = df.index.max() if last is None else max(last, df.index.max())
+    # Hours of the kept years in the existing matrix
+    kept_ranges = [previous.year_range(year) for year in kept_years]
+    for start, stop in kept_ranges:
+        if start < stop:
+            year_first, year_last = previous.timestamps(start, stop)[[0, -1]]
+            first = year_first if first is None else min(first, year_first)
+            last = year_last if last is None else max(last, year_last)
+
+    n_hours = (last - first) // HOUR + 1
+    counts = np.lib.format.open_memmap(
+        f"{path}.tmp", mode="w+", dtype="int32", shape=(len(stations), n_hours)
+    )
+    counts[:] = MISSING
+    for start, stop in kept_ranges:
+        offset = (previous.origin - first) // HOUR
+        counts[: len(previous.counts), start + offset : stop + offset] = previous.counts[:, start:stop]
+    for year in read_years:
+        df = load_dataset(columns=["station_code", "total_bikes"], years=[year], path=dataset_path)
+        station_rows = df.station_code.to_numpy()
+        positions = ((df.index - first) // HOUR).to_numpy()
+        counts[station_rows, positions] = 0
+        np.add.at(counts, (station_rows, positions), df.total_bikes.to_numpy())
+    counts.flush()
+    del counts, previous
+
+    with open(f"{index_path(path)}.tmp", "w") as file:
+        json.dump(
+            {"origin": first.isoformat(), "stations": stations.to_dict(orient="records")},
+            file,
+            indent=2,
+        )
+    os.replace(f"{path}.tmp", path)
+    os.replace(f"{index_path(path)}.tmp", index_path(path))
+
+
+def load_count_matrix(path=MATRIX_PATH):
+    """opens the count matrix read-only and memory-mapped, None if it has not been built
+
+    All processes opening the file share its pages in the page cache.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(index_path(path)) as file:
+        index = json.load(file)
+    stations = pd.DataFrame(index["stations"]).astype(
+        {"station_short": "int8", "lat": "float32", "lon": "float32"}
+    )
+    stations.index.name = "station_code"
+    counts = np.load(path, mmap_mode="r")
+    return CountMatrix(counts, stations, pd.Timestamp(index["origin"]))
@@ -0,0 +1,115 @@
+"""reports unique and proportional memory of a gunicorn master and its workers (linux only)
+
+    gunicorn -c gunicorn.conf.py app:server &
+    python memory_report.py --warm http://localhost:8050
+
+USS is the memory only the process itself uses, PSS adds its share of the pages
+shared with the other processes. With the data shared between the workers, the
+USS of a worker stays small and the total PSS grows much less than linearly with
+the number of workers.
+"""
+
+import argparse
+import json
+import os
+import random
+import urllib.request
+
+FIELDS = ["Rss", "Pss", "Private_Clean", "Private_Dirty", "Shared_Clean", "Shared_Dirty"]
+
+
+def memory(pid):
+    """returns rss, pss, uss and shared memory of a process in MB"""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as file:
+        for line in file:
+            name, _, rest = line.partition(":")
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "uss": values["Private_Clean"] + values["Private_Dirty"],
+        "shared": values["Shared_Clean"] + values["Shared_Dirty"],
+    }
+
+
+def children(pid):
+    """returns pids of the child processes"""
+    pids = []
+    for name in os.listdir("/proc"):
+        if name.isdigit():
+            try:
+                with open(f"/proc/{name}/stat") as file:
+                    # the parent pid follows the command name in parentheses
+                    parent = int(file.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if parent == pid:
+                pids.append(int(name))
+    return sorted(pids)
+
+
+def warm(url, n_requests, seed=0):
+    """sends polar and comparison chart requests with random inputs, so workers touch the data"""
+    rng = random.Random(seed)
+    with urllib.request.urlopen(url) as response:
+        response.read()
+    for _ in range(n_requests):
+        years = rng.sample(["2017", "2018", "2019"], rng.randint(1, 3))
+        station = rng.choice(["Maybachufer", "Jannowitzbrücke Nord", "Kaisersteg", "Schwedter Steg"])
+        inputs = {
+            "year-dropdown": years,
+            "station-dropdown": station,
+            "timeframe-dropdown": rng.choice(["hour_str", "day_name", "month_name"]),
+            "radialrange-dropdown": rng.choice(["max", "p95", "median", "mean"]),
+            "comparison-dropdown": rng.choice(["sum", "mean", "median", "p95", "max"]),
+        }
+        for output, input_ids in [
+            ("scatter-polar", list(inputs)[:4]),
+            ("comparison-bar", ["year-dropdown", "station-dropdown", "comparison-dropdown"]),
+        ]:
+            payload = {
+                "output": f"{output}.figure",
+                "outputs": {"id": output, "property": "figure"},
+                "inputs": [
+                    {"id": item, "property": "value", "value": inputs[item]} for item in input_ids
+                ],
+                "changedPropIds": ["year-dropdown.value"],
+                "state": [],
+            }
+            request = urllib.request.Request(
+                f"{url.rstrip('/')}/_dash-update-component",
+                data=json.dumps(payload).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            with urllib.request.urlopen(request) as response:
+                response.read()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pid", type=int, help="pid of the gunicorn master")
+    parser.add_argument("--pidfile", default="gunicorn.pid", help="pidfile of the gunicorn master")
+    parser.add_argument("--warm", metavar="URL", help="send callback requests to the dashboard first")
+    parser.add_argument("--requests", type=int, default=50, help="number of warm-up requests")
+    args = parser.parse_args()
+
+    if args.pid is None:
+        with open(args.pidfile) as file:
+            args.pid = int(file.read())
+    if args.warm:
+        warm(args.warm, args.requests)
+
+    processes = [("master", args.pid)] + [("worker", pid) for pid in children(args.pid)]
+    print(f"{'process':<8} {'pid':>8} {'RSS MB':>9} {'PSS MB':>9} {'USS MB':>9} {'shared MB':>10}")
+    totals = {"rss": 0, "pss": 0, "uss": 0}
+    for role, pid in processes:
+        usage = memory(pid)
+        for key in totals:
+            totals[key] += usage[key]
+        print(
+            f"{role:<8} {pid:>8} {usage['rss']:>9.1f} {usage['pss']:>9.1f} "
+            f"{usage['uss']:>9.1f} {usage['shared']:>10.1f}"
+        )
+    print(f"{'total':<8} {'':>8} {totals['rss']:>9.1f} {totals['pss']:>9.1f} {totals['uss']:>9.1f}")
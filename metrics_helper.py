@@ -0,0 +1,190 @@
+"""helper functions for timing callbacks and their stages in prometheus text format
+
+Metrics are kept per process, with several gunicorn workers each one reports its own.
+"""
+
+import cProfile
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+from flask import Response, g, request
+
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+# callbacks slower than this many milliseconds are profiled and dumped to PROFILE_DIR, off if unset
+PROFILE_SLOW_MS = os.environ.get("BIKE_PROFILE_SLOW_MS")
+PROFILE_DIR = os.environ.get("BIKE_PROFILE_DIR", "profiles")
+
+
+def label_string(names, values):
+    """returns labels like {stage="aggregate"}"""
+    return ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    """prometheus histogram of observed values per combination of label values"""
+
+    def __init__(self, name, description, labels, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> bucket counts, sum and count of the observed values
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """adds value to the buckets it falls into"""
+        with self.lock:
+            series = self.series.setdefault(
+                label_values, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def lines(self):
+        """returns lines of the prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                labels = label_string(self.labels, label_values)
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {series["count"]}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series['sum']}")
+                lines.append(f"{self.name}_count{{{labels}}} {series['count']}")
+        return lines
+
+
+class Counter:
+    """prometheus counter per combination of label values"""
+
+    def __init__(self, name, description, labels):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount, *label_values):
+        """adds amount to the counter"""
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def lines(self):
+        """returns lines of the prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{{{label_string(self.labels, label_values)}}} {value}")
+        return lines
+
+
+CALLBACK_SECONDS = Histogram(
+    "bike_callback_seconds", "duration of dashboard callbacks including cache hits", ["callback"]
+)
+STAGE_SECONDS = Histogram(
+    "bike_stage_seconds", "duration of the stages of callbacks computing a result", ["stage"]
+)
+REQUEST_SECONDS = Histogram(
+    "bike_request_seconds",
+    "duration of http requests including json serialization of callback results",
+    ["route", "output"],
+)
+ROWS_PROCESSED = Counter(
+    "bike_rows_processed_total", "rows processed by callback stages", ["stage"]
+)
+
+
+@contextmanager
+def timed(stage):
+    """times a stage of a callback, rows processed can be set on the yielded object"""
+    counts = SimpleNamespace(rows=0)
+    start = time.perf_counter()
+    try:
+        yield counts
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+        if counts.rows:
+            ROWS_PROCESSED.inc(counts.rows, stage)
+
+
+def profile_path(name, seconds):
+    """returns file name for the profile of a slow callback"""
+    name = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{seconds * 1000:.0f}ms.prof"
+    return os.path.join(PROFILE_DIR, name)
+
+
+def instrument(name):
+    """times a callback and dumps a cProfile of calls slower than BIKE_PROFILE_SLOW_MS"""
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            profiler = None
+            if PROFILE_SLOW_MS:
+                profiler = cProfile.Profile()
+                try:
+                    profiler.enable()
+                except ValueError:  # another thread is being profiled
+                    profiler = None
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                seconds = time.perf_counter() - start
+                CALLBACK_SECONDS.observe(seconds, name)
+                if profiler is not None:
+                    profiler.disable()
+                    if seconds * 1000 > float(PROFILE_SLOW_MS):
+                        os.makedirs(PROFILE_DIR, exist_ok=True)
+                        profiler.dump_stats(profile_path(name, seconds))
+
+        return wrapper
+
+    return decorator
+
+
+def cache_lines(cache):
+    """returns hit and miss counters of a result cache in prometheus text format"""
+    lines = []
+    for key, value in cache.info().items():
+        kind = "gauge" if key == "size" else "counter"
+        name = f"bike_cache_{key}" if kind == "gauge" else f"bike_cache_{key}_total"
+        lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+    return lines
+
+
+def register_metrics(server, cache=None, route="/metrics"):
+    """times all requests of the flask server and serves the metrics in prometheus text format"""
+
+    @server.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @server.after_request
+    def observe_request(response):
+        if "request_start" in g and request.url_rule is not None:
+            output = ""
+            if request.path.endswith("/_dash-update-component"):
+                output = (request.get_json(silent=True) or {}).get("output", "")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - g.request_start, request.url_rule.rule, output
+            )
+        return response
+
+    def metrics():
+        lines = []
+        for metric in [CALLBACK_SECONDS, STAGE_SECONDS, REQUEST_SECONDS, ROWS_PROCESSED]:
+            lines += metric.lines()
+        if cache is not None:
+            lines += cache_lines(cache)
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+    server.add_url_rule(route, "metrics", metrics)
@@ -0,0 +1,61 @@
+"""helper functions for the station x year partition index of the hourly counts"""
+
+import numpy as np
+import pandas as pd
+
+
+class PartitionIndex:
+    """hourly counts sorted by station code and time with the rows of every station and year
+
+    The rows of a station and year are a contiguous slice of the sorted table, so
+    selections are read as views of the slices instead of masks over all rows.
+    """
+
+    def __init__(self, counts):
+        codes = counts.station_code.to_numpy()
+        order = np.lexsort((counts.index.asi8, codes))
+        if (np.diff(order) != 1).any():
+            counts = counts.iloc[order]
+            codes = codes[order]
+        self.counts = counts
+        years = counts.year.to_numpy()
+        changes = np.flatnonzero((codes[1:] != codes[:-1]) | (years[1:] != years[:-1])) + 1
+        starts = np.concatenate([[0], changes])
+        stops = np.concatenate([changes, [len(counts)]])
+        # (station code, year) -> first and past-the-end row
+        self.ranges = {
+            (int(codes[start]), int(years[start])): (int(start), int(stop))
+            for start, stop in zip(starts, stops)
+        }
+        self.first = counts.index.min()
+        self.last = counts.index.max()
+
+    def slices(self, codes=None, years=None):
+        """returns row ranges of the selected stations and years, adjacent ranges merged"""
+        codes = None if codes is None else {int(code) for code in codes}
+        years = None if years is None else {int(year) for year in years}
+        slices = []
+        for (code, year), (start, stop) in self.ranges.items():
+            if (codes is None or code in codes) and (years is None or year in years):
+                if slices and slices[-1][1] == start:
+                    slices[-1] = (slices[-1][0], stop)
+                else:
+                    slices.append((start, stop))
+        return slices
+
+    def size(self, codes=None, years=None):
+        """returns number of rows of the selected stations and years"""
+        return sum(stop - start for start, stop in self.slices(codes, years))
+
+    def select(self, codes=None, years=None):
+        """returns hourly counts of the selected stations and years
+
+        A selection of adjacent partitions is a view of the sorted table, only
+        selections of several separate slices are copied.
+        """
+        slices = self.slices(codes, years)
+        if len(slices) == 1:
+            return self.counts.iloc[slices[0][0] : slices[0][1]]
+        if not slices:
+            return self.counts.iloc[:0]
+        return pd.concat([self.counts.iloc[start:stop] for start, stop in slices])
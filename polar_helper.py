@@ -2,28 +2,88 @@
 
 import pandas as pd
 
+from dataset_helper import calendar_labels, station_code
 
-def prepare_data_for_polar(complete_df, CATEGORY, CAT_SORTERS, station):
-    """creates dataframes for median and max values for polar chart"""
-    df_median = (
-        complete_df[(complete_df.description == station)]
-        .groupby([CATEGORY, CAT_SORTERS[CATEGORY]])[["total_bikes"]]
-        .median()
-        .reset_index()
-        .sort_values(CAT_SORTERS[CATEGORY])
+# Quantiles of the hourly counts shown in the polar chart, besides mean and max
+QUANTILES = {"p25": 0.25, "median": 0.5, "p75": 0.75, "p95": 0.95}
+POLAR_STATISTICS = list(QUANTILES) + ["mean", "max"]
+
+
+def polar_statistics(df, keys):
+    """returns quantiles, mean and max of total bikes per group of keys
+
+    All statistics are computed from one grouping of the table.
+    """
+    grouped = df.groupby(keys, observed=True)["total_bikes"]
+    stats = grouped.quantile(list(QUANTILES.values())).unstack()
+    stats.columns = list(QUANTILES)
+    stats["mean"] = grouped.mean()
+    stats["max"] = grouped.max()
+    return stats.reset_index()
+
+
+def label_polar_data(stats_df, CATEGORY, CAT_SORTERS, station):
+    """adds labels and location to the statistics, returns parts for polar chart"""
+    stats_df.insert(0, CATEGORY, calendar_labels(CATEGORY, stats_df[CAT_SORTERS[CATEGORY]]))
+    stats_df["location"] = station
+    radialrange_dict = {statistic: stats_df[statistic].max() for statistic in POLAR_STATISTICS}
+    categories = stats_df[CATEGORY]
+    return stats_df, radialrange_dict, categories
+
+
+def prepare_data_for_polar(complete_df, CATEGORY, CAT_SORTERS, station, stations):
+    """creates dataframe of quantiles, mean and max values for polar chart
+
+    Labels of the CATEGORY column are derived from the integer sorter column.
+    """
+    station_df = complete_df[complete_df.station_code == station_code(stations, station)]
+    stats_df = polar_statistics(station_df, CAT_SORTERS[CATEGORY])
+    return label_polar_data(stats_df, CATEGORY, CAT_SORTERS, station)
+
+
+def cube_covers(cube, years):
+    """returns whether the profiles of the rollup cube cover the selected years
+
+    Quantiles cannot be combined across years, so only single years are covered.
+    """
+    return (
+        cube is not None
+        and len(years) == 1
+        and set(POLAR_STATISTICS).issubset(cube.profiles.columns)
     )
-    df_median["location"] = station
-    df_max = (
-        complete_df[(complete_df.description == station)]
-        .groupby([CATEGORY, CAT_SORTERS[CATEGORY]])[["total_bikes"]]
-        .max()
-        .reset_index()
-        .sort_values(CAT_SORTERS[CATEGORY])
+
+
+def cube_profile(cube, code, years, sorter):
+    """returns statistics of a station per value of sorter from the rollup cube, None if it does not cover it"""
+    if not cube_covers(cube, years):
+        return None
+    profile = cube.profiles[
+        (cube.profiles.station_code == code)
+        & (cube.profiles.year == years[0])
+        & (cube.profiles.sorter == sorter)
+    ].sort_values("value")
+    return (
+        profile[["value"] + POLAR_STATISTICS]
+        .rename(columns={"value": sorter})
+        .reset_index(drop=True)
+    )
+
+
+def matrix_profile(matrix, code, years, sorter):
+    """returns statistics of a station per value of sorter from the count matrix"""
+    counts, hours = matrix.station_hours(code, years)
+    station_df = pd.DataFrame({sorter: getattr(hours, sorter), "total_bikes": counts})
+    return polar_statistics(station_df, sorter)
+
+
+def partition_profile(partitions, code, years, sorter):
+    """returns statistics of a station per value of sorter from the partition index"""
+    return polar_statistics(partitions.select([code], years), sorter)
+
+
+def prepare_data_for_polar_from_engine(engine, CATEGORY, CAT_SORTERS, station, stations, years):
+    """creates dataframe of quantiles, mean and max values for polar chart with a query engine"""
+    stats_df = engine.station_profile(
+        station_code(stations, station), years, CAT_SORTERS[CATEGORY]
     )
-    df_max["location"] = station
-    radialrange_dict = {
-        "max": df_max["total_bikes"].max(),
-        "median": df_median["total_bikes"].max(),
-    }
-    categories = df_median[CATEGORY]
-    return df_median, df_max, radialrange_dict, categories
+    return label_polar_data(stats_df, CATEGORY, CAT_SORTERS, station)
@@ -0,0 +1,112 @@
+"""renders every figure reachable from the dashboard dropdowns to the store of precomputed results"""
+
+import argparse
+import logging
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import combinations, product, repeat
+
+import app
+from cache_helper import FIGURES_DIR, FIGURES_PATH, FigureStore
+
+logger = logging.getLogger(__name__)
+
+
+def dropdown_values(component_id):
+    """returns option values of a dropdown of the dashboard layout"""
+    for component in app.app.layout._traverse():
+        if getattr(component, "id", None) == component_id:
+            return [option["value"] for option in component.options]
+    raise KeyError(component_id)
+
+
+def callback_inputs():
+    """returns callback name and arguments of every reachable figure"""
+    years = dropdown_values("year-dropdown")
+    year_selections = [
+        list(selection) for n in range(1, len(years) + 1) for selection in combinations(years, n)
+    ]
+    stations = dropdown_values("station-dropdown")
+    timeframes = dropdown_values("timeframe-dropdown")
+    radialranges = dropdown_values("radialrange-dropdown")
+    aggregations = dropdown_values("comparison-dropdown")
+    streets = dropdown_values("two-direction-station-dropdown")
+    frequencies = dropdown_values("frequency-dropdown")
+    tasks = [
+        ("update_fig", args) for args in product(year_selections, stations, timeframes, radialranges)
+    ]
+    tasks += [
+        ("update_comparison_fig", args)
+        for args in product(year_selections, stations, aggregations)
+    ]
+    tasks += [("update_barchart_store", (street,)) for street in streets]
+    tasks += [("update_barchart_fig", args) for args in product(streets, frequencies, [None])]
+    return tasks
+
+
+def render(task, directory, version):
+    """computes the result of one callback and writes it to the store
+
+    Returns False if the callback failed, its result is then left to the dashboard.
+    """
+    name, args = task
+    callback = getattr(app, name)
+    try:
+        FigureStore(directory, version).write(callback.key(*args), callback.compute(*args))
+    except Exception:
+        logger.exception("%s%s failed, skipped", name, tuple(args))
+        return False
+    return True
+
+
+def precompute(path=FIGURES_PATH, workers=1):
+    """writes the results of all reachable callback inputs and replaces the previous store
+
+    Failing callbacks are skipped. Returns the number of results written.
+    """
+    tasks = callback_inputs()
+    # the data has to be loaded before the workers are forked
+    app.engine.load()
+    directory = f"{path}.tmp"
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.makedirs(directory)
+    try:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                written = list(
+                    executor.map(
+                        render, tasks, repeat(directory), repeat(app.data_version), chunksize=16
+                    )
+                )
+        else:
+            written = [render(task, directory, app.data_version) for task in tasks]
+        FigureStore(directory, app.data_version).write_version()
+    except BaseException:
+        # the previous store is kept
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(directory, path)
+    if not all(written):
+        logger.warning("%d of %d results failed", len(written) - sum(written), len(written))
+    return sum(written)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--output", default=FIGURES_DIR or FIGURES_PATH, help="directory of the precomputed results"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=os.cpu_count(), help="number of processes rendering figures"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    start = time.perf_counter()
+    n_results = precompute(args.output, args.workers)
+    print(f"{n_results} results written to {args.output} in {time.perf_counter() - start:.1f} s")
@@ -0,0 +1,277 @@
+"""query engines answering the aggregate queries of the dashboard
+
+Both engines return the same tables: statistics per hour, weekday or month of a
+station (station_profile), an aggregate per station code (station_totals) and
+totals of some stations resampled to days, weeks, months or years (street_timeseries).
+"""
+
+import os
+import threading
+
+import pandas as pd
+
+from barchart_helper import street_timeseries
+from comparison_helper import ComparisonBetweenStations, aggregate_per_code
+from dataset_helper import CSV_PATH, DATASET_PATH, BackgroundLoad
+from metrics_helper import timed
+from polar_helper import QUANTILES, cube_covers, cube_profile, matrix_profile, partition_profile
+
+try:
+    import duckdb
+except ImportError:  # duckdb is optional, only the pandas engine is available without it
+    duckdb = None
+
+# pandas for the loaded data, duckdb to query the parquet dataset or csv file directly
+QUERY_ENGINE = os.environ.get("BIKE_QUERY_ENGINE", "pandas")
+# threads of the duckdb scans, all cores if unset
+DUCKDB_THREADS = os.environ.get("BIKE_DUCKDB_THREADS")
+
+
+class PandasEngine:
+    """queries on the rollup cube, the count matrix or the partition index of the hourly counts
+
+    data is a BackgroundLoad of partition index, count matrix and cube, the cube
+    and matrix are used where they cover a query.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def load(self):
+        """waits for the data to be loaded"""
+        self.data.get()
+
+    def extent(self):
+        """returns first and last day with counts"""
+        partitions, matrix, cube = self.data.get()
+        if cube is None:
+            return partitions.first.normalize(), partitions.last.normalize()
+        return cube.daily.index.min(), cube.daily.index.max()
+
+    def station_profile(self, code, years, sorter):
+        """returns quantiles, mean and max of the hourly counts of a station per value of sorter"""
+        partitions, matrix, cube = self.data.get()
+        # Only the source answering the query is timed
+        if cube_covers(cube, years):
+            with timed("station_profile[cube]") as stage:
+                stats_df = cube_profile(cube, code, years, sorter)
+                stage.rows = len(cube.profiles)
+        elif matrix is not None:
+            with timed("station_profile[matrix]") as stage:
+                stats_df = matrix_profile(matrix, code, years, sorter)
+                # hours of the selected years in the row of the station
+                stage.rows = sum(stop - start for start, stop in map(matrix.year_range, years))
+        else:
+            with timed("station_profile[partitions]") as stage:
+                stats_df = partition_profile(partitions, code, years, sorter)
+                stage.rows = partitions.size([code], years)
+        return stats_df
+
+    def station_totals(self, years, aggregation):
+        """returns aggregation of the daily totals per station code in the given years"""
+        partitions, matrix, cube = self.data.get()
+        source = "partitions" if cube is None else "cube"
+        with timed(f"station_totals[{source}]") as stage:
+            # Hourly counts of the selected years, only needed without the cube
+            df = partitions.select(years=years) if cube is None else None
+            bikes_df = aggregate_per_code(df, ComparisonBetweenStations(years, aggregation), cube)
+            stage.rows = len(df) if cube is None else len(cube.daily)
+        return bikes_df
+
+    def street_timeseries(self, codes, frequency_short):
+        """returns total bikes of the station codes resampled to frequency_short"""
+        partitions, matrix, cube = self.data.get()
+        source = "partitions" if cube is None else "cube"
+        with timed(f"street_timeseries[{source}]") as stage:
+            # Hourly counts of the stations, only needed without the cube
+            df = partitions.select(codes) if cube is None else None
+            barchart_df = street_timeseries(df, codes, frequency_short, cube)
+            stage.rows = len(df) if cube is None else len(cube.daily)
+        return barchart_df
+
+
+# Bins of the resampled totals as first day of the bin and step, labelled by their last day
+BINS = {
+    "D": ("day", "INTERVAL 1 DAY", "start"),
+    "W": ("week", "INTERVAL 1 WEEK", "start + INTERVAL 6 DAY"),
+    "M": ("month", "INTERVAL 1 MONTH", "last_day(start)"),
+    "Y": ("year", "INTERVAL 1 YEAR", "start + INTERVAL 1 YEAR - INTERVAL 1 DAY"),
+}
+
+# Statistics of the daily totals per station, mean counts every day of the selected years
+# between the first and the last day with data just like resampling
+STATION_TOTALS = {
+    "sum": "SUM(total_bikes)",
+    "mean": "SUM(total_bikes) / ({selected_days})",
+    "median": "quantile_cont(total_bikes, 0.5)",
+    "p95": "quantile_cont(total_bikes, 0.95)",
+    "max": "MAX(total_bikes)",
+    "weekday_mean": "AVG(total_bikes) FILTER (WHERE isodow(day) <= 5)",
+    "weekend_mean": "AVG(total_bikes) FILTER (WHERE isodow(day) > 5)",
+}
+
+
+def sql_list(values):
+    """returns integers as sql list"""
+    return ", ".join(str(int(value)) for value in values)
+
+
+def selected_days(years):
+    """returns sql expression of the days of the selected years between the first and last day of a station"""
+    return " + ".join(
+        f"greatest(date_diff('day', greatest(MIN(day), DATE '{int(year)}-01-01'), "
+        f"least(MAX(day), DATE '{int(year)}-12-31')) + 1, 0)"
+        for year in years
+    )
+
+
+class DuckDBEngine:
+    """queries on the parquet dataset, or the csv file if it has not been built, with duckdb
+
+    Only the columns and year partitions a query needs are read, with all cores
+    scanning in parallel. The hourly counts are never loaded into pandas.
+    Every process opens its own in-memory database, each thread queries with its own cursor.
+    """
+
+    def __init__(self, stations, path=DATASET_PATH, csv_path=CSV_PATH, threads=DUCKDB_THREADS):
+        if duckdb is None:
+            raise ImportError("BIKE_QUERY_ENGINE=duckdb needs the duckdb package")
+        self.stations = stations
+        self.path = path
+        self.csv_path = csv_path
+        self.threads = threads
+        self.connection = None
+        self.pid = None
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self._extent = None
+
+    def load(self):
+        """nothing to load, the files are read by the queries"""
+
+    def cursor(self):
+        """returns cursor of this thread on the database of this process"""
+        with self.lock:
+            # A database opened before gunicorn forked the workers must not be shared
+            if self.pid != os.getpid():
+                config = {} if self.threads is None else {"threads": int(self.threads)}
+                self.connection = duckdb.connect(config=config)
+                self._create_stations()
+                self.pid = os.getpid()
+                self.local = threading.local()
+            if getattr(self.local, "cursor", None) is None:
+                self.local.cursor = self.connection.cursor()
+        return self.local.cursor
+
+    def _create_stations(self):
+        """copies the station codes into the database for the csv file"""
+        stations_df = self.stations.reset_index()[["station_code", "station"]]
+        self.connection.register("stations_df", stations_df)
+        self.connection.execute("CREATE TABLE stations AS SELECT * FROM stations_df")
+        self.connection.unregister("stations_df")
+
+    def source(self):
+        """returns sql relation of the hourly counts with station codes"""
+        if os.path.exists(self.path):
+            # hidden partitions being replaced by data_wrangling.py do not match year=*
+            files = os.path.join(self.path, "year=*", "*.parquet").replace("'", "''")
+            return f"read_parquet('{files}', hive_partitioning = true)"
+        csv_path = self.csv_path.replace("'", "''")
+        return f"(SELECT * FROM read_csv_auto('{csv_path}') JOIN stations USING (station))"
+
+    def query(self, sql):
+        """returns result of a query as dataframe"""
+        return self.cursor().execute(sql).df()
+
+    def extent(self):
+        """returns first and last day with counts"""
+        if self._extent is None:
+            first, last = self.cursor().execute(
+                f"SELECT MIN(timestamp), MAX(timestamp) FROM {self.source()}"
+            ).fetchone()
+            self._extent = pd.Timestamp(first).normalize(), pd.Timestamp(last).normalize()
+        return self._extent
+
+    def station_profile(self, code, years, sorter):
+        """returns quantiles, mean and max of the hourly counts of a station per value of sorter"""
+        quantiles = ", ".join(
+            f"quantile_cont(total_bikes, {quantile}) AS {name}" for name, quantile in QUANTILES.items()
+        )
+        with timed("station_profile[duckdb]"):
+            stats_df = self.query(
+                f"""
+                SELECT {sorter}, {quantiles}, AVG(total_bikes) AS mean, MAX(total_bikes) AS max
+                FROM {self.source()}
+                WHERE station_code = {int(code)} AND year IN ({sql_list(years)})
+                GROUP BY {sorter}
+                ORDER BY {sorter}
+                """
+            )
+        return stats_df.astype({sorter: "int8", "max": "int32"})
+
+    def station_totals(self, years, aggregation):
+        """returns aggregation of the daily totals per station code in the given years"""
+        statistic = STATION_TOTALS[aggregation].format(selected_days=selected_days(years))
+        with timed("station_totals[duckdb]"):
+            bikes_df = self.query(
+                f"""
+                WITH daily AS (
+                    SELECT station_code, CAST(timestamp AS DATE) AS day, SUM(total_bikes) AS total_bikes
+                    FROM {self.source()}
+                    WHERE year IN ({sql_list(years)})
+                    GROUP BY ALL
+                )
+                SELECT station_code, {statistic} AS total_bikes
+                FROM daily
+                GROUP BY station_code
+                HAVING total_bikes IS NOT NULL
+                ORDER BY station_code
+                """
+            )
+        if aggregation in ["sum", "max"]:
+            bikes_df["total_bikes"] = bikes_df.total_bikes.astype("int64")
+        return bikes_df.astype({"station_code": "int8"}).set_index("station_code")
+
+    def street_timeseries(self, codes, frequency_short):
+        """returns total bikes of the station codes resampled to frequency_short
+
+        Bins without counts between the first and the last bin of a station are 0,
+        just like resampling.
+        """
+        unit, step, label = BINS[frequency_short]
+        with timed("street_timeseries[duckdb]"):
+            barchart_df = self.query(
+                f"""
+                WITH bins AS (
+                    SELECT station_code, CAST(date_trunc('{unit}', timestamp) AS DATE) AS start,
+                        SUM(total_bikes) AS total_bikes
+                    FROM {self.source()}
+                    WHERE station_code IN ({sql_list(codes)})
+                    GROUP BY ALL
+                ),
+                grid AS (
+                    SELECT station_code, CAST(unnest(generate_series(MIN(start), MAX(start), {step})) AS DATE) AS start
+                    FROM bins
+                    GROUP BY station_code
+                )
+                SELECT station_code, CAST({label} AS TIMESTAMP) AS timestamp,
+                    CAST(COALESCE(total_bikes, 0) AS BIGINT) AS total_bikes
+                FROM grid LEFT JOIN bins USING (station_code, start)
+                ORDER BY station_code, timestamp
+                """
+            )
+        return barchart_df.astype(
+            {"station_code": "int8", "timestamp": "datetime64[ns]", "total_bikes": "int32"}
+        )
+
+
+def make_engine(load, stations, name=QUERY_ENGINE):
+    """returns query engine selected by BIKE_QUERY_ENGINE
+
+    The pandas engine starts loading the data in the background right away.
+    """
+    if name == "duckdb":
+        return DuckDBEngine(stations)
+    if name != "pandas":
+        raise ValueError(f"unknown query engine {name!r}, use pandas or duckdb")
+    return PandasEngine(BackgroundLoad(load))
@@ -0,0 +1,116 @@
+"""registry of the bicycle counters from the Standortdaten sheet"""
+
+import json
+import os
+
+import pandas as pd
+
+STATIONS_PATH = "berlin_bikedata_2017-2019_stations.json"
+STATION_ID_FIXES = {"17-SZ-BRE-O": "17-SK-BRE-O", "17-SZ-BRE-W": "17-SK-BRE-W"}
+DIRECTIONS = ["Nord", "Süd", "Ost", "West"]
+LOCATION_COLUMNS = {
+    "Zählstelle": "station",
+    "Beschreibung - Fahrtrichtung": "description",
+    "Breitengrad": "lat",
+    "Längengrad": "lon",
+    "Installationsdatum": "installed",
+}
+
+
+def normalize_station_id(station_id):
+    """returns station id without surrounding blanks and with known typos fixed"""
+    station_id = str(station_id).strip()
+    return STATION_ID_FIXES.get(station_id, station_id)
+
+
+class StationRegistry:
+    """bicycle counters indexed by integer station code
+
+    Codes are positions in the table and never change once assigned,
+    counters first seen in a count sheet are appended without location data.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    @classmethod
+    def from_locations(cls, locations, previous=None):
+        """builds registry from the Standortdaten sheet, keeping the codes of a previous registry"""
+        table = locations.rename(columns=LOCATION_COLUMNS)[list(LOCATION_COLUMNS.values())]
+        table["station"] = table.station.map(normalize_station_id)
+        table = table.drop_duplicates("station").sort_values("station")
+        if previous is not None:
+            order = previous.table.station.tolist()
+            known = set(order)
+            order += [item for item in table.station if item not in known]
+            table = table.set_index("station").reindex(order).reset_index()
+        return cls(cls._with_derived_columns(table.reset_index(drop=True)))
+
+    @staticmethod
+    def _with_derived_columns(table):
+        """adds direction and numeric counter id shared by both directions of a street"""
+        table.index.name = "station_code"
+        last_word = table.description.astype(str).str.rsplit(" ", n=1).str[-1]
+        table["direction"] = last_word.where(last_word.isin(DIRECTIONS))
+        table["station_short"] = table.station.str.split("-", n=1).str[0].astype(int)
+        return table
+
+    def __len__(self):
+        return len(self.table)
+
+    def codes(self, station_ids):
+        """returns codes for raw station ids of a count sheet, registering unknown ids"""
+        station_ids = [normalize_station_id(item) for item in station_ids]
+        known = set(self.table.station)
+        unknown = [item for item in dict.fromkeys(station_ids) if item not in known]
+        if unknown:
+            added = pd.DataFrame({"station": unknown, "description": unknown})
+            self.table = self._with_derived_columns(
+                pd.concat([self.table.drop(columns=["direction", "station_short"]), added])
+                .reset_index(drop=True)
+            )
+        lookup = pd.Series(self.table.index.to_numpy(), index=self.table.station.to_numpy())
+        return lookup.loc[station_ids].to_numpy()
+
+    @property
+    def stations(self):
+        """returns station table in the layout used by the dashboard"""
+        stations = self.table[["station", "description", "station_short", "lat", "lon"]].copy()
+        return stations.astype(
+            {"description": str, "station_short": "int8", "lat": "float32", "lon": "float32"}
+        )
+
+    def with_station_columns(self, df):
+        """replaces station_code of a long table by station id, description, lat and lon"""
+        codes = df["station_code"].to_numpy()
+        df = df.drop(columns="station_code")
+        df.insert(0, "station", self.table.station.to_numpy()[codes])
+        for column in ["description", "lat", "lon"]:
+            df[column] = self.table[column].to_numpy()[codes]
+        return df
+
+
+def write_station_registry(registry, path=STATIONS_PATH):
+    """writes registry as json records"""
+    table = registry.table.drop(columns=["direction", "station_short"])
+    with open(f"{path}.tmp", "w") as file:
+        file.write(
+            table.to_json(
+                orient="records",
+                date_format="iso",
+                double_precision=15,
+                force_ascii=False,
+                indent=2,
+            )
+        )
+    os.replace(f"{path}.tmp", path)
+
+
+def load_station_registry(path=STATIONS_PATH):
+    """returns registry written by write_station_registry, None if there is none"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        table = pd.DataFrame(json.load(file), columns=list(LOCATION_COLUMNS.values()))
+    table["installed"] = pd.to_datetime(table.installed)
+    return StationRegistry(StationRegistry._with_derived_columns(table))
@@ -0,0 +1,94 @@
+"""helper functions for the sqlite store of the station table, hourly counts and daily totals
+
+The counts and daily totals have their primary key on station code and time,
+so the rows of a station and time range are one range of the index.
+"""
+
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+
+from dataset_helper import DATASET_PATH, dataset_years, load_dataset
+
+STORE_PATH = "berlin_bikedata_2017-2019.sqlite"
+
+SCHEMA = """
+CREATE TABLE stations (
+    station_code INTEGER PRIMARY KEY,
+    station TEXT UNIQUE NOT NULL,
+    description TEXT,
+    station_short INTEGER,
+    lat REAL,
+    lon REAL
+);
+CREATE TABLE counts (
+    station_code INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    total_bikes INTEGER NOT NULL,
+    PRIMARY KEY (station_code, timestamp)
+) WITHOUT ROWID;
+CREATE TABLE daily (
+    station_code INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    total_bikes INTEGER NOT NULL,
+    PRIMARY KEY (station_code, day)
+) WITHOUT ROWID;
+"""
+
+
+def write_store(stations, dataset_path=DATASET_PATH, path=STORE_PATH, years=None):
+    """writes station table, hourly counts and daily totals of the parquet dataset to a sqlite file
+
+    The dataset is read one year at a time. Counts of duplicate hours are added up.
+    With years given, only these years are read and the rows of the other years
+    are kept from the existing store. The file is swapped in once it is complete.
+    """
+    all_years = dataset_years(dataset_path)
+    if os.path.exists(f"{path}.tmp"):
+        os.remove(f"{path}.tmp")
+    update = years is not None and os.path.exists(path)
+    if update:
+        shutil.copyfile(path, f"{path}.tmp")
+    connection = sqlite3.connect(f"{path}.tmp")
+    try:
+        if update:
+            read_years = sorted(set(years) & set(all_years))
+            kept = ", ".join(f"'{year}'" for year in all_years if year not in read_years)
+            connection.execute(f"DELETE FROM counts WHERE substr(timestamp, 1, 4) NOT IN ({kept})")
+            connection.execute(f"DELETE FROM daily WHERE substr(day, 1, 4) NOT IN ({kept})")
+            connection.execute("DELETE FROM stations")
+        else:
+            read_years = all_years
+            connection.executescript(SCHEMA)
+        connection.executemany(
+            "INSERT INTO stations VALUES (?, ?, ?, ?, ?, ?)",
+            stations[["station", "description", "station_short", "lat", "lon"]]
+            .astype({"station_short": int, "lat": float, "lon": float})
+            .itertuples(name=None),
+        )
+        for year in read_years:
+            df = load_dataset(columns=["station_code", "total_bikes"], years=[year], path=dataset_path)
+            hourly = df.groupby(["station_code", df.index], observed=True).total_bikes.sum()
+            connection.executemany(
+                "INSERT INTO counts VALUES (?, ?, ?)",
+                zip(
+                    hourly.index.get_level_values(0).astype(int),
+                    np.datetime_as_string(hourly.index.get_level_values(1).to_numpy(), unit="s"),
+                    hourly.to_numpy().astype(int).tolist(),
+                ),
+            )
+            connection.execute(
+                """
+                INSERT INTO daily
+                SELECT station_code, substr(timestamp, 1, 10), SUM(total_bikes)
+                FROM counts WHERE timestamp >= ? AND timestamp < ?
+                GROUP BY station_code, substr(timestamp, 1, 10)
+                """,
+                (f"{year}-01-01", f"{year + 1}-01-01"),
+            )
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(f"{path}.tmp", path)
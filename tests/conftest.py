@@ -0,0 +1,37 @@
+"""shared fixtures of the tests, the helper modules are imported from the repository root"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_wrangling  # noqa: E402
+from benchmark import make_locations, make_station_ids, make_year_sheet, write_synthetic_build  # noqa: E402
+from station_helper import StationRegistry  # noqa: E402
+
+YEARS = [2017, 2018, 2019]
+
+
+@pytest.fixture(scope="session")
+def years():
+    """returns years of the synthetic build"""
+    return YEARS
+
+
+@pytest.fixture(scope="session")
+def build(tmp_path_factory):
+    """returns directory with the dataset, cube, registry, count matrix and store of synthetic counts"""
+    station_ids = make_station_ids(6)
+    registry = StationRegistry.from_locations(make_locations(station_ids))
+    sheets = [make_year_sheet(year, station_ids, missing_share=0.05) for year in YEARS]
+    table = data_wrangling.transform_concat_dataframes(sheets, registry)
+    directory = tmp_path_factory.mktemp("build")
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        write_synthetic_build(table, registry)
+    finally:
+        os.chdir(working_directory)
+    return directory
@@ -0,0 +1,48 @@
+"""tests of the aggregates of the comparison chart"""
+
+import pandas as pd
+import pytest
+
+from comparison_helper import ComparisonBetweenStations, aggregate_daily
+
+
+@pytest.fixture
+def daily():
+    """returns daily totals of a station counting 100 bikes a day, 200 in 2018, and one starting in July 2017"""
+    days = pd.date_range("2017-01-01", "2019-12-31", freq="D")
+    tables = []
+    for code, start in [(0, "2017-01-01"), (1, "2017-07-01")]:
+        station_days = days[days >= start]
+        tables.append(
+            pd.DataFrame(
+                {
+                    "station_code": code,
+                    "total_bikes": [200 if day.year == 2018 else 100 for day in station_days],
+                    "year": station_days.year,
+                    "weekday": station_days.weekday,
+                },
+                index=pd.DatetimeIndex(station_days, name="timestamp"),
+            )
+        )
+    return pd.concat(tables)
+
+
+@pytest.mark.parametrize(
+    "years, expected",
+    [([2017], 100), ([2019], 100), ([2017, 2019], 100), ([2018], 200), ([2017, 2018, 2019], None)],
+)
+def test_mean_day_only_counts_days_of_selected_years(daily, years, expected):
+    bikes = aggregate_daily(daily, ComparisonBetweenStations(years, "mean")).total_bikes
+    if expected is None:
+        # every day of the span counts once
+        expected = daily[daily.station_code == 0].total_bikes.mean()
+    assert bikes.loc[0] == pytest.approx(expected)
+    assert bikes.loc[1] == pytest.approx(
+        daily[(daily.station_code == 1) & daily.year.isin(years)].total_bikes.mean()
+    )
+
+
+def test_mean_day_counts_missing_days_as_zero(daily):
+    daily = daily.drop(pd.date_range("2019-03-01", "2019-03-10"))
+    bikes = aggregate_daily(daily, ComparisonBetweenStations([2017, 2019], "mean")).total_bikes
+    assert bikes.loc[0] == pytest.approx(100 * (730 - 10) / 730)
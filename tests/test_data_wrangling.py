@@ -0,0 +1,163 @@
+"""regression tests of the reshaping of the year sheets and of incremental builds"""
+
+import logging
+import os
+import runpy
+import sqlite3
+import sys
+
+import pandas as pd
+import pytest
+
+import cube_helper
+import data_wrangling
+import dataset_helper
+import matrix_helper
+import store_helper
+from benchmark import legacy_create_yearly_table, make_locations, make_station_ids, make_year_sheet
+from cube_helper import CUBE_PATH, build_cube
+from data_wrangling import create_yearly_table
+from dataset_helper import DATASET_PATH, load_compact_dataset
+from matrix_helper import MATRIX_PATH, load_count_matrix
+from station_helper import StationRegistry, load_station_registry
+from store_helper import STORE_PATH
+
+
+@pytest.mark.parametrize("year", [2019, 2020])
+def test_create_yearly_table_matches_legacy_implementation(year):
+    # 16 stations include the ids fixed by STATION_ID_FIXES, 2020 is a leap year
+    station_ids = make_station_ids(16)
+    locations = make_locations(station_ids)
+    registry = StationRegistry.from_locations(locations)
+    sheet = make_year_sheet(year, station_ids, missing_share=0.05)
+
+    pd.testing.assert_frame_equal(
+        registry.with_station_columns(create_yearly_table(sheet, registry)),
+        legacy_create_yearly_table(sheet, locations),
+    )
+
+
+STATION_IDS = make_station_ids(3)
+# Hours of the year sheets in the workbooks of the incremental tests
+HOURS = 24 * 30
+
+
+def write_workbook(path, sheets):
+    """writes the Standortdaten sheet and year sheets in the format of the source workbook"""
+    with pd.ExcelWriter(path) as writer:
+        make_locations(STATION_IDS).to_excel(writer, sheet_name="Standortdaten", index=False)
+        for year, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=f"Jahresdatei {year}", index=False)
+
+
+def run_incremental(workbook, years, workers=1):
+    """runs data_wrangling.py --incremental in the working directory"""
+    argv = [
+        "data_wrangling.py", "--incremental", "--workbook", str(workbook),
+        "--first-year", str(years[0]), "--last-year", str(years[-1]), "--workers", str(workers),
+    ]
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(sys, "argv", argv)
+        runpy.run_module("data_wrangling", run_name="__main__", alter_sys=True)
+
+
+@pytest.fixture
+def sheets(years):
+    """returns year sheets of HOURS hours"""
+    return {year: make_year_sheet(year, STATION_IDS, missing_share=0.05).iloc[:HOURS] for year in years}
+
+
+@pytest.fixture
+def incremental_build(tmp_path, monkeypatch, sheets, years):
+    """returns working directory with an incremental build of the sheets, the last one without its last day"""
+    monkeypatch.chdir(tmp_path)
+    write_workbook("workbook.xlsx", {**sheets, years[-1]: sheets[years[-1]].iloc[:-24]})
+    run_incremental("workbook.xlsx", years)
+    return tmp_path
+
+
+@pytest.fixture
+def read_years(monkeypatch):
+    """returns list of the years the cube, count matrix and store read from the dataset"""
+    read = []
+
+    def load_dataset(*args, years=None, **kwargs):
+        read.extend(years)
+        return dataset_helper.load_dataset(*args, years=years, **kwargs)
+
+    for module in [cube_helper, matrix_helper, store_helper]:
+        monkeypatch.setattr(module, "load_dataset", load_dataset)
+    return read
+
+
+def assert_matches_full_build(stations, sheets):
+    """checks dataset, cube, count matrix and store of the working directory against a build of the sheets"""
+    registry = StationRegistry.from_locations(make_locations(STATION_IDS))
+    table = data_wrangling.transform_concat_dataframes(list(sheets.values()), registry)
+    data = load_compact_dataset()
+    pd.testing.assert_frame_equal(
+        data.counts.sort_values(["station_code", "timestamp"])[["station_code", "total_bikes"]],
+        table.sort_values(["station_code", "timestamp"])[["station_code", "total_bikes"]],
+        check_dtype=False,
+    )
+    # Cubes updated per year hold the rows in another order
+    for name, expected in build_cube(table).items():
+        columns = list(expected.columns)
+        pd.testing.assert_frame_equal(
+            pd.read_parquet(os.path.join(CUBE_PATH, f"{name}.parquet")).sort_values(columns, ignore_index=True),
+            expected.sort_values(columns, ignore_index=True),
+            check_dtype=False,
+        )
+    matrix = load_count_matrix()
+    for code in stations.index:
+        counts, _ = matrix.station_hours(code, list(sheets))
+        assert counts.sum() == table.total_bikes[table.station_code == code].sum()
+    with sqlite3.connect(STORE_PATH) as connection:
+        totals = dict(connection.execute("SELECT station_code, SUM(total_bikes) FROM daily GROUP BY station_code"))
+    assert totals == table.groupby("station_code").total_bikes.sum().to_dict()
+
+
+def test_incremental_skips_unchanged_sheets(incremental_build, read_years, years, monkeypatch, caplog):
+    parsed = []
+    read_excel = pd.read_excel
+
+    def parse(path, sheet_name, **kwargs):
+        parsed.append(sheet_name)
+        return read_excel(path, sheet_name=sheet_name, **kwargs)
+
+    monkeypatch.setattr(pd, "read_excel", parse)
+    # A saved again workbook has another file digest, the xml parts of its sheets stay the same
+    manifest = data_wrangling.read_manifest()
+    manifest["workbook_sha256"] = None
+    data_wrangling.write_manifest(manifest)
+    files = {name: os.path.getmtime(name) for name in [CUBE_PATH, MATRIX_PATH, STORE_PATH]}
+    with caplog.at_level(logging.INFO):
+        run_incremental("workbook.xlsx", years)
+    assert [f"Jahresdatei {year}: unchanged" for year in years] == caplog.messages[: len(years)]
+    assert parsed == ["Standortdaten"]
+    assert read_years == []
+    assert files == {name: os.path.getmtime(name) for name in files}
+
+
+def test_incremental_appends_hours(incremental_build, read_years, sheets, years, caplog):
+    write_workbook("workbook.xlsx", sheets)
+    with caplog.at_level(logging.INFO):
+        run_incremental("workbook.xlsx", years)
+    assert f"Jahresdatei {years[-1]}: appended 24 hours" in caplog.messages
+    assert set(read_years) == {years[-1]}
+    assert len(os.listdir(os.path.join(DATASET_PATH, f"year={years[-1]}"))) == 2
+    assert_matches_full_build(load_station_registry().stations, sheets)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_incremental_rebuilds_changed_sheets(incremental_build, read_years, sheets, years, workers, caplog):
+    changed = {**sheets, years[0]: sheets[years[0]].copy()}
+    changed[years[0]].iloc[100, 1] = 12345
+    write_workbook("workbook.xlsx", changed)
+    with caplog.at_level(logging.INFO):
+        run_incremental("workbook.xlsx", years, workers=workers)
+    assert f"Jahresdatei {years[0]}: rebuilt {HOURS} hours" in caplog.messages
+    assert f"Jahresdatei {years[1]}: unchanged" in caplog.messages
+    assert f"Jahresdatei {years[-1]}: appended 24 hours" in caplog.messages
+    assert set(read_years) == {years[0], years[-1]}
+    assert_matches_full_build(load_station_registry().stations, changed)
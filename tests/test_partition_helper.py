@@ -0,0 +1,36 @@
+"""tests of the partition index, slices hold the same rows as masks over the whole table"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataset_helper import DATASET_PATH, load_compact_dataset
+from partition_helper import PartitionIndex
+from station_helper import STATIONS_PATH
+
+
+@pytest.fixture(scope="module")
+def counts(build):
+    """returns hourly counts of the synthetic build in the order of the dataset"""
+    return load_compact_dataset(
+        path=os.path.join(build, DATASET_PATH), stations_path=os.path.join(build, STATIONS_PATH)
+    ).counts
+
+
+@pytest.mark.parametrize(
+    "codes, selected_years",
+    [(None, None), ([0], None), ([1, 3], [2018]), ([2, 4], [2017, 2019]), ([5], [2016])],
+)
+def test_select_matches_masks(counts, codes, selected_years):
+    partitions = PartitionIndex(counts.sample(frac=1, random_state=0))
+    mask = np.ones(len(counts), dtype=bool)
+    if codes is not None:
+        mask &= counts.station_code.isin(codes).to_numpy()
+    if selected_years is not None:
+        mask &= counts.year.isin(selected_years).to_numpy()
+    expected = counts[mask].reset_index().sort_values(["station_code", "timestamp"])
+    selected = partitions.select(codes, selected_years)
+    assert partitions.size(codes, selected_years) == len(expected)
+    pd.testing.assert_frame_equal(selected.reset_index(), expected.reset_index(drop=True))
@@ -0,0 +1,112 @@
+"""parity tests of the query engines, every engine answers like the pandas engine on the hourly counts"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from barchart_helper import street_codes
+from comparison_helper import AGGREGATIONS
+from cube_helper import CUBE_PATH, load_cube
+from dataset_helper import DATASET_PATH, BackgroundLoad, load_compact_dataset
+from matrix_helper import MATRIX_PATH, load_count_matrix
+from metrics_helper import STAGE_SECONDS
+from partition_helper import PartitionIndex
+from query_helper import DuckDBEngine, PandasEngine
+from station_helper import STATIONS_PATH
+
+# Selections of the years of the build, the first and last year leave out the years between
+SELECTIONS = {
+    "last year": lambda years: years[-1:],
+    "first and last year": lambda years: [years[0], years[-1]],
+    "all years": lambda years: years,
+}
+
+
+@pytest.fixture(scope="module")
+def data(build):
+    """returns hourly counts and station table of the synthetic build"""
+    return load_compact_dataset(
+        path=os.path.join(build, DATASET_PATH), stations_path=os.path.join(build, STATIONS_PATH)
+    )
+
+
+@pytest.fixture(scope="module")
+def expected(data):
+    """returns pandas engine on the partition index of the hourly counts"""
+    return PandasEngine(BackgroundLoad(lambda: (PartitionIndex(data.counts), None, None)))
+
+
+@pytest.fixture(scope="module", params=["cube", "duckdb"])
+def engine(request, build, data):
+    """returns pandas engine on the cube and count matrix, or duckdb engine on the parquet dataset"""
+    if request.param == "duckdb":
+        pytest.importorskip("duckdb")
+        return DuckDBEngine(data.stations, path=os.path.join(build, DATASET_PATH))
+    return PandasEngine(
+        BackgroundLoad(
+            lambda: (
+                None,
+                load_count_matrix(os.path.join(build, MATRIX_PATH)),
+                load_cube(os.path.join(build, CUBE_PATH)),
+            )
+        )
+    )
+
+
+def test_extent(engine, expected):
+    assert engine.extent() == expected.extent()
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+@pytest.mark.parametrize("sorter", ["hour", "weekday", "month"])
+def test_station_profile(engine, expected, data, years, sorter, selection):
+    selected = SELECTIONS[selection](years)
+    for code in data.stations.index:
+        pd.testing.assert_frame_equal(
+            engine.station_profile(code, selected, sorter),
+            expected.station_profile(code, selected, sorter),
+            check_dtype=False,
+        )
+
+
+@pytest.mark.parametrize("selection, source", [("last year", "cube"), ("all years", "matrix")])
+def test_station_profile_times_only_answering_source(build, data, years, selection, source):
+    engine = PandasEngine(
+        BackgroundLoad(
+            lambda: (
+                None,
+                load_count_matrix(os.path.join(build, MATRIX_PATH)),
+                load_cube(os.path.join(build, CUBE_PATH)),
+            )
+        )
+    )
+    engine.load()
+    stages = ["station_profile[cube]", "station_profile[matrix]"]
+    before = {stage: STAGE_SECONDS.series.get((stage,), {"count": 0})["count"] for stage in stages}
+    engine.station_profile(data.stations.index[0], SELECTIONS[selection](years), "hour")
+    observed = [
+        stage for stage in stages if STAGE_SECONDS.series.get((stage,), {"count": 0})["count"] > before[stage]
+    ]
+    assert observed == [f"station_profile[{source}]"]
+
+
+@pytest.mark.parametrize("selection", SELECTIONS)
+@pytest.mark.parametrize("aggregation", AGGREGATIONS)
+def test_station_totals(engine, expected, years, aggregation, selection):
+    selected = SELECTIONS[selection](years)
+    pd.testing.assert_frame_equal(
+        engine.station_totals(selected, aggregation),
+        expected.station_totals(selected, aggregation),
+        check_dtype=False,
+    )
+
+
+@pytest.mark.parametrize("frequency_short", ["D", "W", "M", "Y"])
+def test_street_timeseries(engine, expected, data, frequency_short):
+    codes = street_codes(data.stations, data.stations.station_short.iloc[0])
+    pd.testing.assert_frame_equal(
+        engine.street_timeseries(codes, frequency_short).reset_index(drop=True),
+        expected.street_timeseries(codes, frequency_short).reset_index(drop=True),
+        check_dtype=False,
+    )